@@ -1,5 +1,12 @@
+import logging
 from . import raw
 from . import io
 from . import classes
 from . import epochs
 from . import utils
+from . import filters
+from . import stats
+from . import instrument
+from . import online
+
+logging.getLogger(__name__).addHandler(logging.NullHandler()) #silent unless logging is set up
@@ -0,0 +1,335 @@
+import numpy as np
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+import argparse
+from . import io
+from . import utils
+
+def make_asc(fname, duration = 60, srate = 1000, binocular = False, nblocks = 1, blink_rate = 15, msg_rate = 1, saccade_rate = 120, seed = 0):
+    '''
+    write a synthetic EyeLink asc file, with the same layout as one converted by edf2asc, for testing and benchmarking
+
+    duration     - length of each block of recording (seconds)
+    srate        - sampling rate (Hz)
+    binocular    - if True both eyes are recorded, otherwise just the left eye. can be a list, giving the value for each block
+    nblocks      - number of START/END blocks of recording
+    blink_rate   - blinks per minute. blinks are missing data ('.' for gaze, 0 for pupil), with SBLINK/EBLINK events
+    msg_rate     - MSG lines (triggers) per second. these cycle through trig1, trig2 and trig3
+    saccade_rate - saccades per minute, with SSACC/ESACC and SFIX/EFIX events around them
+    seed         - seed for the random number generator, so the same file is made each time
+    '''
+    rng = np.random.default_rng(seed)
+    binocular = list(np.atleast_1d(binocular))
+    step  = 1000/srate #tracker time is in ms
+    nsamp = int(duration * srate)
+    t0    = 1000000
+    with open(fname, 'w') as f:
+        f.write('** CONVERTED FROM synthetic.edf using edfapi 4.2\n** DATE: Thu Jan  1 00:00:00 2026\n** TYPE: EDF_FILE BINARY EVENT SAMPLE TAGGED\n\n')
+        f.write(f'MSG\t{t0-100} DISPLAY_COORDS 0 0 1919 1079\n')
+        for iblock in range(nblocks):
+            bino = bool(binocular[iblock % len(binocular)])
+            eyes = ['L', 'R'] if bino else ['L']
+            neyes = len(eyes)
+            times = t0 + np.round(np.arange(nsamp) * step).astype(int)
+            eyenames = '\t'.join(['LEFT', 'RIGHT'][:neyes])
+            f.write(f'START\t{times[0]} \t{eyenames}\tSAMPLES\tEVENTS\nPRESCALER\t1\nVPRESCALER\t1\nPUPIL\tAREA\n')
+            f.write(f'EVENTS\tGAZE\t{eyenames}\tRATE\t{srate:.2f}\tTRACKING\tCR\tFILTER\t2\n')
+            f.write(f'SAMPLES\tGAZE\t{eyenames}\tRATE\t{srate:.2f}\tTRACKING\tCR\tFILTER\t2\tINPUT\n')
+
+            #slow changes in pupil size, with some noise on top. both eyes follow the same signal
+            walk  = np.cumsum(rng.normal(0, 1, nsamp)) / np.sqrt(srate)
+            pupil = 1500 + 200*np.sin(2*np.pi*0.1*np.arange(nsamp)/srate) + 50*walk
+            pupil = pupil[None, :] + rng.normal(0, 2, (neyes, nsamp))
+            xpos  = 960 + rng.normal(0, 2, (neyes, nsamp))
+            ypos  = 540 + rng.normal(0, 2, (neyes, nsamp))
+
+            events = [] #(sample, line) pairs, written out in order with the samples
+            #saccades: gaze jumps to a new position, with fixations in between
+            nsacc = rng.poisson(saccade_rate * duration / 60)
+            candidates = np.arange(1, max(nsamp - int(0.1*srate), 2))
+            saccstarts = np.sort(rng.choice(candidates, size = min(nsacc, candidates.size), replace = False))
+            fixstart = 0
+            for start in saccstarts:
+                dur = max(int(rng.uniform(0.02, 0.06) * srate), 1)
+                end = min(start + dur, nsamp - 1)
+                newx, newy = rng.uniform(200, 1700), rng.uniform(100, 1000)
+                sx, sy = xpos[0, start], ypos[0, start]
+                ramp = np.linspace(0, 1, end - start + 1)
+                xpos[:, start:end+1] += (newx - sx) * ramp
+                ypos[:, start:end+1] += (newy - sy) * ramp
+                xpos[:, end+1:] += newx - sx
+                ypos[:, end+1:] += newy - sy
+                ampl = np.hypot(newx - sx, newy - sy) / 35 #in degrees, roughly
+                for eye in eyes:
+                    if start - 1 > fixstart:
+                        events.append((fixstart, f'SFIX {eye}   {times[fixstart]}'))
+                        events.append((start - 1, f'EFIX {eye}   {times[fixstart]}\t{times[start-1]}\t{times[start-1]-times[fixstart]+1}\t  {sx:6.1f}\t  {sy:6.1f}\t   {pupil[0, start-1]:6.0f}'))
+                    events.append((start, f'SSACC {eye}  {times[start]}'))
+                    events.append((end, f'ESACC {eye}  {times[start]}\t{times[end]}\t{times[end]-times[start]+1}\t  {sx:6.1f}\t  {sy:6.1f}\t  {newx:6.1f}\t  {newy:6.1f}\t   {ampl:5.2f}\t    {ampl*40:5.0f}'))
+                fixstart = end + 1
+
+            #blinks: pupil drops quickly, then data are missing
+            missing = np.zeros((neyes, nsamp), dtype = bool)
+            nblink = rng.poisson(blink_rate * duration / 60)
+            for start in rng.integers(int(0.05*srate), max(nsamp - int(0.5*srate), int(0.05*srate)+1), nblink):
+                dur = int(rng.uniform(0.08, 0.3) * srate)
+                edge = max(int(0.02*srate), 1)
+                pupil[:, start-edge:start] *= np.linspace(1, 0.3, edge) #eyelid closing
+                missing[:, start:start+dur] = True
+                end = min(start + dur, nsamp) - 1
+                for eye in eyes:
+                    events.append((start, f'SBLINK {eye} {times[start]}'))
+                    events.append((end, f'EBLINK {eye} {times[start]}\t{times[end]}\t{times[end]-times[start]+1}'))
+
+            #messages (triggers)
+            nmsg = int(msg_rate * duration)
+            for imsg, sample in enumerate(np.sort(rng.choice(nsamp, size = min(nmsg, nsamp), replace = False))):
+                events.append((sample, f'MSG\t{times[sample]} trig{imsg%3+1}'))
+            events.sort(key = lambda x: x[0])
+
+            #format the samples, with missing data as '.' (and 0 for pupil)
+            cols = []
+            for ieye in range(neyes):
+                cols += [np.where(missing[ieye], '   .', np.char.mod('%7.1f', xpos[ieye])),
+                         np.where(missing[ieye], '   .', np.char.mod('%7.1f', ypos[ieye])),
+                         np.where(missing[ieye], '    0.0', np.char.mod('%7.1f', pupil[ieye]))]
+            flags = '\t127.0\t' + ('.....' if bino else '...')
+            lines = np.char.mod('%d', times)
+            for col in cols:
+                lines = np.char.add(np.char.add(lines, '\t'), col)
+            lines = np.char.add(lines, flags)
+
+            ievent = 0
+            for start in range(0, nsamp, 10000): #write in chunks, putting the events in between samples
+                stop = min(start + 10000, nsamp)
+                chunk = []
+                prev = start
+                while ievent < len(events) and events[ievent][0] < stop:
+                    sample, line = events[ievent]
+                    chunk.extend(lines[prev:sample])
+                    chunk.append(line)
+                    prev = max(sample, prev)
+                    ievent += 1
+                chunk.extend(lines[prev:stop])
+                f.write('\n'.join(chunk) + '\n')
+            f.write(f'END\t{times[-1]} \tSAMPLES\tEVENTS\tRES\t  37.00\t  36.80\n')
+            t0 = times[-1] + 5000 #gap between blocks
+            f.write(f'MSG\t{t0-2500} BLOCK_END\n')
+    return fname
+
+#the stages that are benchmarked, in order. each takes the output of the one before
+def _stage_parse(fname, state):
+    state['data'] = io.parse_eyes(fname, srate = state['srate'])
+
+def _stage_nan_missingdata(fname, state):
+    state['data'].nan_missingdata()
+
+def _stage_identify_blinks(fname, state):
+    state['data'].identify_blinks()
+
+def _stage_interpolate_blinks(fname, state):
+    state['data'].interpolate_blinks()
+
+def _stage_cubicfit(fname, state):
+    state['data'].cubicfit()
+
+def _stage_epochs(fname, state):
+    data = state['data']
+    channels = ['pupil_corrected_l', 'pupil_corrected_r'] if data.data[0].binocular else ['pupil_corrected']
+    utils.epochs(data, tmin = -0.5, tmax = 1.5, triggers = ['trig1', 'trig2', 'trig3'], channels = channels)
+
+stages = dict(parse_eyes = _stage_parse, nan_missingdata = _stage_nan_missingdata, identify_blinks = _stage_identify_blinks,
+              interpolate_blinks = _stage_interpolate_blinks, cubicfit = _stage_cubicfit, epochs = _stage_epochs)
+
+def run(durations = (60, 600), srate = 1000, binocular = False, nblocks = 1, blink_rate = 15, msg_rate = 1, repeat = 3,
+        memory = True, outdir = None, seed = 0):
+    '''
+    time each stage of preprocessing on synthetic asc files of different lengths (durations, in seconds per block).
+
+    each stage is timed repeat times and the fastest is kept. throughput is in samples (per eye) a second.
+    if memory is True, the pipeline is run once more with tracemalloc, to get the peak memory used by each stage
+    (this is done separately, as tracemalloc slows things down). returns a dict of results, which can be saved with json
+    '''
+    results = dict(python = platform.python_version(), numpy = np.__version__, platform = platform.platform(),
+                   date = time.strftime('%Y-%m-%d %H:%M:%S'), config = dict(srate = srate, binocular = binocular, nblocks = nblocks,
+                   blink_rate = blink_rate, msg_rate = msg_rate, repeat = repeat, seed = seed), runs = [])
+    with tempfile.TemporaryDirectory(dir = outdir) as tmpdir:
+        for duration in durations:
+            fname = make_asc(os.path.join(tmpdir, f'bench_{duration}.asc'), duration = duration, srate = srate, binocular = binocular,
+                             nblocks = nblocks, blink_rate = blink_rate, msg_rate = msg_rate, seed = seed)
+            nsamples = int(duration * srate) * nblocks
+            entry = dict(duration = duration, nsamples = nsamples, filesize = os.path.getsize(fname), stages = dict())
+            for name in stages:
+                entry['stages'][name] = dict(time = np.inf)
+            for irepeat in range(repeat):
+                state = dict(srate = srate)
+                for name, stage in stages.items():
+                    start = time.perf_counter()
+                    stage(fname, state)
+                    entry['stages'][name]['time'] = min(entry['stages'][name]['time'], time.perf_counter() - start)
+            for name in stages:
+                entry['stages'][name]['samples_per_s'] = nsamples / entry['stages'][name]['time']
+            entry['stages']['parse_eyes']['mb_per_s'] = entry['filesize'] / 1e6 / entry['stages']['parse_eyes']['time']
+            if memory:
+                state = dict(srate = srate)
+                tracemalloc.start()
+                for name, stage in stages.items():
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    stage(fname, state)
+                    entry['stages'][name]['peak_mb'] = (tracemalloc.get_traced_memory()[1] - before) / 1e6
+                tracemalloc.stop()
+            del state
+            os.remove(fname)
+            results['runs'].append(entry)
+    return results
+
+def check_memory(duration = 600, binocular = True, nblocks = 1, limit = 2.1, outdir = None, seed = 0):
+    '''
+    check the peak memory of preprocessing in place (nan_missingdata, identify_blinks, interpolate_blinks, smooth_pupil, cubicfit).
+    it passes if the peak is at most limit times the memory of the raw data (as parsed). the new channels the steps add come to about
+    as much again as the raw data, so this leaves room for little more than the steps' chunk-sized temporary arrays.
+    returns a dict with the raw, final and peak sizes (MB), the peak as a ratio of the raw size, and whether it passed
+    '''
+    import scipy.interpolate, scipy.ndimage, scipy.signal #import these up front, so the modules themselves aren't counted
+    with tempfile.TemporaryDirectory(dir = outdir) as tmpdir:
+        fname = make_asc(os.path.join(tmpdir, 'check_memory.asc'), duration = duration, binocular = binocular, nblocks = nblocks, seed = seed)
+        tracemalloc.start()
+        data  = io.parse_eyes(fname)
+        rawbytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak() #don't count parsing
+    data.nan_missingdata().identify_blinks().interpolate_blinks().smooth_pupil().cubicfit()
+    heldbytes, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(check = 'memory', raw_mb = rawbytes / 1e6, held_mb = heldbytes / 1e6, peak_mb = peak / 1e6, ratio = peak / rawbytes,
+                limit = limit, ok = peak <= limit * rawbytes)
+
+def check_precision(duration = 600, binocular = True, nblocks = 2, rtol = 1e-5, outdir = None, seed = 0):
+    '''
+    check that the pipeline gives the same results in single precision as in double: pupil_corrected of every eye has to be within
+    rtol of the size of the pupil trace (float32 keeps about 7 significant digits, so pupil sizes in the thousands differ by up to ~1e-3),
+    and the samples marked to interpolate over (the blink masks) have to be identical.
+    returns a dict with the largest difference in pupil_corrected (absolute, and relative to the pupil trace), the number of samples
+    whose blink mask differs and whether it passed
+    '''
+    with tempfile.TemporaryDirectory(dir = outdir) as tmpdir:
+        fname   = make_asc(os.path.join(tmpdir, 'check_precision.asc'), duration = duration, binocular = binocular, nblocks = nblocks, seed = seed)
+        results = [io.parse_eyes(fname, precision = precision) for precision in ['double', 'single']]
+    for data in results:
+        data.nan_missingdata().identify_blinks().interpolate_blinks().smooth_pupil().cubicfit()
+    maxdiff, reldiff, maskdiff = 0.0, 0.0, 0
+    for double, single in zip(results[0].data, results[1].data):
+        for suffix in ['_l', '_r'] if double.binocular else ['']:
+            diff = np.abs(double.channels.get('pupil_corrected'+suffix) - single.channels.get('pupil_corrected'+suffix))
+            if np.isfinite(diff).any():
+                maxdiff = max(maxdiff, float(np.nanmax(diff)))
+                reldiff = max(reldiff, float(np.nanmax(diff) / np.nanmax(np.abs(double.channels.get('pupil_clean'+suffix)))))
+            #double precision keeps the samples to interpolate over as nans in pupil_nan, single precision as a boolean blinkmask
+            maskdiff += int(np.count_nonzero(np.isnan(double.channels.get('pupil_nan'+suffix)) != single.attrs['blinkmask'+suffix]))
+    return dict(check = 'precision', max_abs_diff = maxdiff, max_rel_diff = reldiff, rtol = rtol, blinkmask_diffs = maskdiff,
+                ok = reldiff <= rtol and maskdiff == 0)
+
+def _block_state(block):
+    '''the channels of a block (copies) and the start/end samples of its blinks, to compare runs'''
+    state = {name: np.array(block.channels.get(name)) for name in block.channels.index}
+    for name, value in block.attrs.items():
+        if name.startswith('blinks'):
+            state[name] = np.column_stack([value.blinkstart, value.blinkend])
+    return state
+
+def check_determinism(duration = 60, binocular = True, nblocks = 4, n_jobs = 4, repeats = 5, outdir = None, seed = 0):
+    '''
+    check that preprocess gives the same result every time when blocks are processed in parallel: the pipeline is run repeats times
+    with n_jobs threads, and every channel and blink of every block has to match (exactly) a run with n_jobs = 1
+    '''
+    steps = ['nan_missingdata', 'identify_blinks', 'interpolate_blinks', 'smooth_pupil', 'cubicfit']
+    with tempfile.TemporaryDirectory(dir = outdir) as tmpdir:
+        fname = make_asc(os.path.join(tmpdir, 'check_determinism.asc'), duration = duration, binocular = binocular, nblocks = nblocks, seed = seed)
+        data  = io.parse_eyes(fname)
+    reference = [_block_state(block) for block in data.preprocess(steps, n_jobs = 1, inplace = False).data]
+    mismatches = 0
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) #switch threads as often as possible, so races between the jobs show up
+    try:
+        for _ in range(repeats):
+            result = data.preprocess(steps, n_jobs = n_jobs, inplace = False)
+            for block, expected in zip(result.data, reference):
+                state = _block_state(block)
+                if state.keys() != expected.keys():
+                    mismatches += 1
+                    continue
+                mismatches += sum(not np.array_equal(state[name], expected[name], equal_nan = True) for name in expected)
+    finally:
+        sys.setswitchinterval(interval)
+    return dict(check = 'determinism', nblocks = nblocks, n_jobs = n_jobs, repeats = repeats, mismatches = mismatches, ok = mismatches == 0)
+
+def compare(old, new):
+    '''
+    print how the times of each stage changed between two sets of results (dicts from run, or the json files they were saved to)
+    '''
+    if isinstance(old, str):
+        with open(old) as handle:
+            old = json.load(handle)
+    if isinstance(new, str):
+        with open(new) as handle:
+            new = json.load(handle)
+    oldruns = {x['duration']: x for x in old['runs']}
+    for run in new['runs']:
+        if run['duration'] not in oldruns:
+            continue
+        print(f"-- {run['duration']}s ({run['nsamples']} samples)")
+        for name, stage in run['stages'].items():
+            if name in oldruns[run['duration']]['stages']:
+                oldtime = oldruns[run['duration']]['stages'][name]['time']
+                print(f"{name:>20}: {oldtime:8.3f}s -> {stage['time']:8.3f}s ({oldtime/stage['time']:5.2f}x)")
+
+def _print_results(results):
+    for run in results['runs']:
+        print(f"-- {run['duration']}s ({run['nsamples']} samples, {run['filesize']/1e6:.1f} MB)")
+        for name, stage in run['stages'].items():
+            peak = f", peak {stage['peak_mb']:8.1f} MB" if 'peak_mb' in stage else ''
+            print(f"{name:>20}: {stage['time']:8.3f}s, {stage['samples_per_s']/1e6:8.2f} M samples/s{peak}")
+
+checks = dict(memory = check_memory, determinism = check_determinism, precision = check_precision)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'benchmark preprocessing on synthetic asc files')
+    parser.add_argument('--durations', type = float, nargs = '+', default = [60, 600], help = 'length of each block (seconds)')
+    parser.add_argument('--srate', type = int, default = 1000)
+    parser.add_argument('--binocular', action = 'store_true')
+    parser.add_argument('--nblocks', type = int, default = 1)
+    parser.add_argument('--blink-rate', type = float, default = 15, help = 'blinks per minute')
+    parser.add_argument('--msg-rate', type = float, default = 1, help = 'triggers per second')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip measuring peak memory')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--out', help = 'json file to save the results to')
+    parser.add_argument('--compare', help = 'json file of earlier results to compare against')
+    parser.add_argument('--check', nargs = '+', choices = list(checks.keys()), help = 'run checks instead of timing the stages')
+    args = parser.parse_args(argv)
+
+    if args.check is not None:
+        results = [checks[name](seed = args.seed) for name in args.check]
+        for result in results:
+            print(', '.join([f'{key} {value:.3g}' if isinstance(value, float) else f'{key} {value}' for key, value in result.items()]))
+        if not all(result['ok'] for result in results):
+            raise SystemExit(1)
+        return results
+
+    results = run(durations = args.durations, srate = args.srate, binocular = args.binocular, nblocks = args.nblocks,
+                  blink_rate = args.blink_rate, msg_rate = args.msg_rate, repeat = args.repeat, memory = not args.no_memory, seed = args.seed)
+    _print_results(results)
+    if args.out is not None:
+        with open(args.out, 'w') as handle:
+            json.dump(results, handle, indent = 2)
+    if args.compare is not None:
+        compare(args.compare, results)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,439 @@
 import numpy as np
 import scipy as sp
 import pickle
-from copy import deepcopy
+import threading
+from copy import copy, deepcopy
 
 class EyeTriggers():
-    def __init__(self):
-        self.timestamp = None
-        self.event_id  = None
+    '''
+    table of the triggers (MSG lines) in a block of data, sorted by timestamp.
+
+    event labels (event_id, the first word of the message) are integer coded: codes holds the code of each trigger and labels the label
+    of each code, so labels[codes] gives the event_id of each trigger (label_codes maps labels back to their code).
+    message keeps the full text of each MSG line after the timestamp
+    '''
+    def __init__(self, timestamp = None, event_id = None, message = None):
+        self.set(np.zeros(0, dtype = int) if timestamp is None else timestamp, [] if event_id is None else event_id, message)
+
+    def set(self, timestamp, event_id, message = None):
+        '''
+        fill the table from arrays of timestamps, event ids and (optionally) messages. the triggers are sorted by timestamp
+        '''
+        timestamp = np.asarray(timestamp, dtype = int)
+        event_id  = np.asarray(event_id, dtype = str)
+        message   = event_id if message is None else np.asarray(message, dtype = str)
+        order = np.argsort(timestamp, kind = 'stable')
+        self._timestamp = timestamp[order]
+        self.message    = message[order]
+        self._encode(event_id[order])
+
+    def _encode(self, event_id):
+        self.labels, codes = np.unique(event_id, return_inverse = True)
+        self.codes = codes.reshape(-1).astype(np.int32)
+        self._reset()
+
+    def _reset(self):
+        #clear anything worked out from the table, as it has changed
+        self._label_codes = None
+        self._byevent     = None
+        self._samples     = None
+        self._sampled_on  = None
+
+    def __len__(self):
+        return self._timestamp.size
+
+    def __getstate__(self):
+        return dict(_timestamp = self._timestamp, message = self.message, labels = self.labels, codes = self.codes)
+
+    def __setstate__(self, state):
+        if 'codes' in state:
+            self.__dict__.update(state)
+            self._reset()
+        else: #pickled before triggers were coded: just has timestamp and event_id
+            self.set(state['timestamp'], state['event_id'])
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, timestamp):
+        self._timestamp = np.asarray(timestamp)
+        self._reset()
+
+    @property
+    def event_id(self):
+        '''
+        label of each trigger
+        '''
+        return self.labels[self.codes]
+
+    @event_id.setter
+    def event_id(self, event_id):
+        event_id = np.asarray(event_id, dtype = str)
+        if self.message.size != event_id.size:
+            self.message = event_id.copy()
+        self._encode(event_id)
+
+    @property
+    def label_codes(self):
+        if self._label_codes is None:
+            self._label_codes = {label: code for code, label in enumerate(self.labels)}
+        return self._label_codes
+
+    def find(self, events):
+        '''
+        indices (in time order) of the triggers with an event_id in events
+        '''
+        if self._byevent is None: #indices of the triggers of each code, worked out once
+            order  = np.argsort(self.codes, kind = 'stable')
+            bounds = np.searchsorted(self.codes[order], np.arange(self.labels.size+1))
+            self._byevent = [order[bounds[icode]:bounds[icode+1]] for icode in range(self.labels.size)]
+        codes = [self.label_codes[x] for x in np.atleast_1d(events) if x in self.label_codes]
+        if len(codes) == 0:
+            return np.zeros(0, dtype = int)
+        if len(codes) == 1:
+            return self._byevent[codes[0]]
+        return np.sort(np.concatenate([self._byevent[code] for code in codes]))
+
+    def in_range(self, tmin, tmax):
+        '''
+        slice of the triggers with tmin <= timestamp < tmax
+        '''
+        return slice(np.searchsorted(self._timestamp, tmin), np.searchsorted(self._timestamp, tmax))
+
+    def get_samples(self, trackertime):
+        '''
+        index of the first sample in trackertime at or after each trigger. this is kept until the triggers, or the trackertime array, change
+        '''
+        if self._sampled_on is not trackertime:
+            self._samples    = np.searchsorted(trackertime, self._timestamp)
+            self._sampled_on = trackertime
+        return self._samples
+
+    def samples_of(self, events, trackertime):
+        '''
+        sample indices (see get_samples) of the triggers with an event_id in events
+        '''
+        return self.get_samples(trackertime)[self.find(events)]
+
+    def select(self, triggers):
+        '''
+        new trigger table with a subset of the triggers (indices, slice or boolean mask). the labels and codes are kept the same
+        '''
+        newtriggers = EyeTriggers.__new__(EyeTriggers)
+        newtriggers._timestamp = self._timestamp[triggers]
+        newtriggers.message    = self.message[triggers]
+        newtriggers.labels     = self.labels
+        newtriggers.codes      = self.codes[triggers]
+        newtriggers._reset()
+        return newtriggers
+
+_storelock = threading.RLock() #stores made by copy() share their segments and row counts, and blocks can be processed in separate threads (see rawEyes.preprocess)
+
+#precision policies for the data: the dtype of the signal channels, and whether samples to interpolate (e.g. blinks) are kept
+#as nan copies of the pupil trace (pupil_nan) or only as boolean masks (blinkmask). tracker time is always kept as integers when it can be
+precisions = dict(double = dict(signals = np.float64, nanchannels = True),
+                  single = dict(signals = np.float32, nanchannels = False))
+
+class ChannelStore():
+    '''
+    the channels of a block of data, stored as the rows of a few contiguous [nrows x nsamples] arrays (segments) with a
+    name -> (segment, row) index. the channels a block starts with are one segment, and each step that adds channels gets its rows
+    from a new segment (see reserve), so adding channels never moves or copies the ones already there.
+
+    renaming or dropping a channel only changes the index, and getting a channel returns a view of its row.
+    rows are never reused once a channel is dropped, so views of a channel stay valid (compact() frees the space they take up).
+    copies made with copy() share the segments, and so do the rows kept by lazy epochs (see share): when a shared channel is then set
+    it is written to a new row (copy-on-write). channels only this store uses are overwritten in place
+    '''
+    __slots__ = ('arrays', 'used', 'index', 'owned')
+
+    def __init__(self, nsamples, dtype = float, capacity = 8):
+        self.arrays = [np.empty(shape = [capacity, nsamples], dtype = dtype)]
+        self.used   = [[0]]    #number of rows of each segment that have been handed out. lists, so they are shared with copies that share the segment
+        self.index  = dict()   #channel name -> (segment, row)
+        self.owned  = set()    #(segment, row) that only this store uses, which can be written to in place
+
+    @classmethod
+    def from_array(cls, array, names):
+        '''
+        make a store from an existing [nchannels x nsamples] array (without copying it), with one channel per row
+        '''
+        store = cls.__new__(cls)
+        store.arrays = [array]
+        store.used   = [[array.shape[0]]]
+        store.index  = {name: (0, irow) for irow, name in enumerate(names)}
+        store.owned  = set(store.index.values())
+        return store
+
+    def __setstate__(self, state):
+        state = state[1] if isinstance(state, tuple) else state #(dict, slots) as pickle gives it for classes with __slots__
+        if 'array' in state: #pickled when all the channels were in a single array
+            state = dict(arrays = [state['array']], used = [state['rowsused']], index = {name: (0, row) for name, row in state['index'].items()},
+                         owned = {(0, row) for row in state['owned']})
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    @property
+    def nsamples(self):
+        return self.arrays[0].shape[1]
+
+    @property
+    def dtype(self):
+        return self.arrays[0].dtype
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays)
+
+    @property
+    def names(self):
+        return list(self.index.keys())
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, name):
+        segment, row = self.index[name]
+        return self.arrays[segment][row]
+
+    def set(self, name, values):
+        '''
+        set a channel. its row is overwritten in place if only this store uses it, otherwise (or for a new channel) it gets a new row
+        '''
+        with _storelock: #a row can't be handed out while another thread is setting a channel
+            key = self.index.get(name)
+            if key is None or key not in self.owned:
+                key = self._newrow()
+            self.arrays[key[0]][key[1]] = values
+            self.index[name] = key
+
+    def share(self, name):
+        '''
+        view of a channel to keep (e.g. for lazy epochs). its row is no longer changed in place, so the view keeps its values when the
+        channel is set again (it is copied to a new row, as for copy())
+        '''
+        with _storelock:
+            self.owned.discard(self.index[name])
+            return self.get(name)
+
+    def row(self, name):
+        '''
+        writable view of the row for a channel, to change in place. this is the channel's own row if only this store uses it.
+        otherwise the channel is copied to a new row first (copy-on-write), so stores that share the segment don't see the changes.
+        a new channel gets a new (uninitialised) row
+        '''
+        with _storelock:
+            key = self.index.get(name)
+            if key is None or key not in self.owned:
+                newkey = self._newrow()
+                if key is not None:
+                    self.arrays[newkey[0]][newkey[1]] = self.arrays[key[0]][key[1]]
+                key = newkey
+            self.index[name] = key
+            return self.arrays[key[0]][key[1]]
+
+    def rename(self, old_name, new_name):
+        self.index[new_name] = self.index.pop(old_name)
+
+    def drop(self, name):
+        del self.index[name]
+
+    def select(self, names):
+        '''
+        get a [nchannels x nsamples] array of a set of channels. this is a view if the channels are in consecutive rows of a segment, otherwise a copy
+        '''
+        keys = [self.index[name] for name in names]
+        if len(keys) > 0 and keys == [(keys[0][0], keys[0][1]+i) for i in range(len(keys))]:
+            return self.arrays[keys[0][0]][keys[0][1]:keys[0][1]+len(keys)]
+        selected = np.empty(shape = [len(keys), self.nsamples], dtype = self.dtype)
+        for irow, (segment, row) in enumerate(keys):
+            selected[irow] = self.arrays[segment][row]
+        return selected
+
+    def copy(self):
+        '''
+        shallow copy that shares the segments with this store, until channels are set (see class docstring)
+        '''
+        newstore = ChannelStore.__new__(ChannelStore)
+        newstore.arrays = list(self.arrays)
+        newstore.used   = list(self.used) #the same counts, so the copies don't both hand out the spare rows of a segment
+        newstore.index  = dict(self.index)
+        newstore.owned  = set()
+        self.owned = set() #the rows are now shared, so neither store writes to them in place
+        return newstore
+
+    def compact(self):
+        '''
+        copy the channels into a single new segment that only holds the rows still in use
+        '''
+        names = self.names
+        selected = self.select(names)
+        self.arrays = [selected if selected.flags.owndata else selected.copy()] #select gives a view if the channels are already in one segment
+        self.used   = [[len(names)]]
+        self.index  = {name: (0, irow) for irow, name in enumerate(names)}
+        self.owned  = set(self.index.values())
+
+    def reserve(self, names):
+        '''
+        make sure the channels in names can be set in consecutive rows (only new or shared channels need new rows). steps that add
+        channels call this before working them out, so a new segment is made (if needed) with the rows for all of them
+        '''
+        with _storelock:
+            nrows = sum(name not in self.index or self.index[name] not in self.owned for name in names)
+            if self.used[-1][0] + nrows > self.arrays[-1].shape[0]:
+                self._addsegment(nrows)
+
+    def _addsegment(self, nrows):
+        #a few spare rows at least, so steps that add one channel at a time don't each get a segment
+        self.arrays.append(np.empty(shape = [max(nrows, 4), self.nsamples], dtype = self.dtype))
+        self.used.append([0])
+
+    def _newrow(self):
+        if self.used[-1][0] >= self.arrays[-1].shape[0]: #no spare rows, so start a new segment
+            self._addsegment(1)
+        key = (len(self.arrays)-1, self.used[-1][0])
+        self.used[-1][0] += 1
+        self.owned.add(key)
+        return key
 
 class EyeHolder():
+    '''
+    a single block of recorded data.
+
+    channels (1d float arrays with one value per sample, e.g. pupil_l, xpos_r, pupil_clean) are kept in a ChannelStore (self.channels),
+    and any other attributes (e.g. blinks) in self.attrs. both can still be got and set as regular attributes (e.g. data.pupil_clean)
+    '''
+    __slots__ = ('info', 'triggers', 'binocular', 'eyes_recorded', 'trackertime', 'time', 'channels', 'attrs')
+
     def __init__(self):
         # self.fsamp = None
         self.info      = dict()
         self.triggers  = EyeTriggers()
         self.binocular = None
         self.eyes_recorded = []
+        self.channels  = None #created when the first channel is added
+        self.attrs     = dict()
+
+    def __getattr__(self, name):
+        #only called if name isn't a slot that has been set
+        if name in EyeHolder.__slots__:
+            raise AttributeError(f"'EyeHolder' object has no attribute '{name}'")
+        if self.channels is not None and name in self.channels:
+            return self.channels.get(name)
+        if name in self.attrs:
+            return self.attrs[name]
+        raise AttributeError(f"'EyeHolder' object has no attribute '{name}'")
+
+    def __setattr__(self, name, value):
+        if name in EyeHolder.__slots__:
+            object.__setattr__(self, name, value)
+        elif self._is_channel(value):
+            if self.channels is None:
+                self.channels = ChannelStore(nsamples = value.size)
+            self.attrs.pop(name, None)
+            self.channels.set(name, value)
+        else:
+            if self.channels is not None and name in self.channels:
+                self.channels.drop(name)
+            self.attrs[name] = value
+
+    def __delattr__(self, name):
+        if name in EyeHolder.__slots__:
+            object.__delattr__(self, name)
+        elif self.channels is not None and name in self.channels:
+            self.channels.drop(name)
+        elif name in self.attrs:
+            del self.attrs[name]
+        else:
+            raise AttributeError(f"'EyeHolder' object has no attribute '{name}'")
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in EyeHolder.__slots__ if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        #state is either the slots of an EyeHolder, or the __dict__ of one pickled before channels were stored in a ChannelStore
+        object.__setattr__(self, 'channels', None)
+        object.__setattr__(self, 'attrs', dict())
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _is_channel(self, value):
+        if not isinstance(value, np.ndarray) or value.ndim != 1 or value.dtype.kind != 'f':
+            return False
+        if self.channels is not None:
+            return value.size == self.channels.nsamples
+        return not hasattr(self, 'trackertime') or value.size == self.trackertime.size
+
+    def keys(self):
+        '''
+        names of all of the attributes of this block (like __dict__.keys() of a regular object)
+        '''
+        names = [name for name in EyeHolder.__slots__[:-2] if hasattr(self, name)]
+        if self.channels is not None:
+            names += self.channels.names
+        return names + list(self.attrs.keys())
+
+    def get_channels(self, channels):
+        '''
+        get a [nchannels x nsamples] array of a set of channels. this is a view of the data if the channels are stored next to each other
+        '''
+        return self.channels.select(channels)
+
+    def select_samples(self, samples):
+        '''
+        keep only some of the samples (index or boolean mask) of the block, across the tracker time and all channels at once
+        '''
+        self.trackertime = self.trackertime[samples]
+        self.time        = self.time[samples]
+        if self.channels is not None:
+            names = self.channels.names
+            self.channels = ChannelStore.from_array(np.ascontiguousarray(self.channels.select(names)[:, samples]), names)
+
+    def copy(self, deep = False):
+        '''
+        copy this block of data. by default this is shallow: the new block has its own info, triggers and attributes,
+        but shares the channel arrays with this one until they are replaced
+        '''
+        if deep:
+            return deepcopy(self)
+        newdata = EyeHolder.__new__(EyeHolder)
+        for name, value in self.__getstate__().items():
+            object.__setattr__(newdata, name, value)
+        newdata.info = self.info.copy()
+        newdata.eyes_recorded = list(self.eyes_recorded)
+        newdata.triggers = copy(self.triggers)
+        newdata.channels = None if self.channels is None else self.channels.copy()
+        newdata.attrs = dict(self.attrs)
+        return newdata
 
     def drop_eye(self, eye_to_drop):
         '''
         this function drops one eye from the data structure, and amends the structure accordingly. From this point on, code will perceive it to be monocular and look for appropriate attributes
         '''
-        eye = eye_to_drop.lower() #force lower case to identify the right attributes
-        not_dropped = ['right' if eye == 'left' else 'left'][0]
-        
         if self.binocular == False:
             raise TypeError('data are already monocular!')
         else:
-            attrs_to_del = [x for x in self.__dict__.keys() if f'_{eye[0]}' in x]
+            self._drop_eye(eye_to_drop)
+
+    def _drop_eye(self, eye_to_drop):
+        eye = eye_to_drop.lower() #force lower case to identify the right attributes
+        not_dropped = ['right' if eye == 'left' else 'left'][0]
+        keys = [x for x in self.keys() if x not in EyeHolder.__slots__]
+        attrs_to_del = []
+        if self.binocular:
+            attrs_to_del = [x for x in keys if f'_{eye[0]}' in x]
             for iattr in attrs_to_del:
                 delattr(self, iattr)
-            attrs_to_rename = [x for x in self.__dict__.keys() if x[-2:] == f'_{not_dropped[0]}']
-            for attr in attrs_to_rename:
-                #rename attribute by creating a new one with the same values, then deleting the old one
-                setattr(self, attr[:-2], getattr(self, attr))
-                delattr(self, attr)
-            
+        attrs_to_rename = [x for x in keys if x[-2:] == f'_{not_dropped[0]}' and x not in attrs_to_del]
+        for attr in attrs_to_rename:
+            #rename attribute without copying any data (channels only change their name in the channel index)
+            self.rename_channel(attr, attr[:-2])
+
         setattr(self, 'binocular', False)
         setattr(self, 'eyes_recorded', [not_dropped])
 
@@ -49,15 +448,17 @@ class EyeHolder():
         if np.unique(sizes).size != 1:
             raise ValueError(f'channels to be averaged across have different trial durations')
         else:
-            chans   = [getattr(self, ichan) for ichan in channels]
-            chans   = np.vstack(chans)
+            if all(ichan in self.channels for ichan in channels):
+                chans = self.channels.select(channels) #works on the stored array directly where possible
+            else:
+                chans = np.vstack([getattr(self, ichan) for ichan in channels])
             newchan = getattr(np, func)(chans, axis=0) #apply function across channels
 
             setattr(self, new_name, newchan)
             if remove_chans:
                 for ichan in channels:
                     delattr(self, ichan)
-    
+
 
     def rename_channel(self, old_name, new_name, delete_channel = True):
         '''
@@ -65,14 +466,62 @@ class EyeHolder():
         '''
         if not hasattr(self, old_name):
             raise AttributeError(f'Attribute {old_name} could not be found')
+        elif delete_channel and self.channels is not None and old_name in self.channels:
+            if new_name in self.attrs:
+                del self.attrs[new_name]
+            self.channels.rename(old_name, new_name) #only changes the channel index
+        elif delete_channel:
+            value = getattr(self, old_name)
+            delattr(self, old_name)
+            setattr(self, new_name, value)
         else:
             setattr(self, new_name, deepcopy(getattr(self, old_name))) #create new attribute with the same data
-            if delete_channel:
-                delattr(self, old_name) #delete the old attribute name
 
 class Blinks():
     def __init__(self, blinkarray):
         self.nblinks = blinkarray.shape[0]
         self.blinkstart = blinkarray[:,0]
         self.blinkend   = blinkarray[:,1]
-        self.blinkdur   = blinkarray[:,2]
\ No newline at end of file
+        self.blinkdur   = blinkarray[:,2]
+
+class EventTable():
+    '''
+    table of events (e.g. saccades) found in one eye, with one array per column (see columns). the first two columns are the start and
+    end of each event as sample indices (the end is the sample after the event), the third its duration in seconds
+    '''
+    columns = []
+
+    def __init__(self, eventarray):
+        eventarray = np.asarray(eventarray, dtype = float).reshape(-1, len(self.columns))
+        for icol, column in enumerate(self.columns):
+            setattr(self, column, eventarray[:, icol])
+
+    def __len__(self):
+        return getattr(self, self.columns[0]).size
+
+    def to_array(self):
+        '''
+        [nevents x ncolumns] array of the table, as it is made from
+        '''
+        return np.array([getattr(self, column) for column in self.columns]).T.reshape(-1, len(self.columns))
+
+class Saccades(EventTable):
+    '''
+    saccades found in the gaze of one eye (see rawEyes.identify_saccades). amplitude and positions are in the units of the gaze channels
+    (e.g. pixels), and peakvel in those units per second
+    '''
+    columns = ['saccstart', 'saccend', 'saccdur', 'amplitude', 'peakvel', 'startx', 'starty', 'endx', 'endy']
+
+    @property
+    def nsaccades(self):
+        return len(self)
+
+class Fixations(EventTable):
+    '''
+    fixations (the periods between saccades, without missing data) of one eye, with the mean gaze position during each
+    '''
+    columns = ['fixstart', 'fixend', 'fixdur', 'fixx', 'fixy']
+
+    @property
+    def nfixations(self):
+        return len(self)
@@ -2,6 +2,7 @@ import numpy as np
 import scipy as sp
 import pandas as pd
 import pickle
+import warnings
 
 class epochedEyes():
     def __init__(self, data, srate, events, times, channels):
@@ -14,67 +15,356 @@ class epochedEyes():
         self.channels = channels
         self.blocks   = None
 
-    def apply_baseline(self, baseline):
-        bmin, bmax = baseline[0], baseline[1]
-        [ntrls, nchannels, ntimes] = self.data.shape
-        #get baseline value per trial
-        blines = np.logical_and(np.greater_equal(self.times, bmin), np.less_equal(self.times, bmax))
-        blinedata = self.data[:,:, blines].mean(axis=-1) #last axis is time, average across time in this window
-        for itrl in range(ntrls):
-            for ichan in range(nchannels):
-                self.data[itrl, ichan] -= blinedata[itrl, ichan]
+    @property
+    def data(self):
+        '''
+        [ntrials x nchannels x ntimes] array of epoched data. for lazy epochs, accessing this copies the epochs out of the continuous data (once)
+        '''
+        if self._data is None and self._source is not None:
+            self._data   = self._source.gather()
+            self._source = None #the epochs own their data from here on
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        if isinstance(data, LazyEpochSource):
+            self._data, self._source = None, data
+        else:
+            self._data, self._source = data, None
+
+    def __setstate__(self, state):
+        state = dict(state)
+        if 'data' in state: #pickled before the data could be lazy: just has the data array
+            state['_data'], state['_source'] = state.pop('data'), None
+        self.__dict__.update(state)
+
+    @property
+    def is_lazy(self):
+        return self._source is not None
+
+    def load_data(self):
+        '''
+        copy lazy epochs out of the continuous data, so they can be modified
+        '''
+        self.data
+        return self
+
+    def get_data(self, trials = None, copy = True):
+        '''
+        get the data for a set of trials (defaults to all trials) as a [ntrials x nchannels x ntimes] array.
+        for lazy epochs only the requested trials are copied out of the continuous data
+        '''
+        if self._source is not None:
+            return self._source.gather(trials)
+        data = self._data if trials is None else self._data[trials]
+        return data.copy() if copy else data
+
+    def get_trial(self, trial):
+        '''
+        get a list of the channels of a single trial. for lazy epochs these are views of the continuous data, unless the epoch runs over the edge of the block
+        '''
+        if self._source is not None:
+            return self._source.trial(trial)
+        return list(self._data[trial])
+
+    def _timeslice(self, tmin = None, tmax = None):
+        '''
+        slice of the time axis from tmin to tmax (inclusive). times are sorted, so this is always a slice (and indexing with it gives a view)
+        '''
+        start = 0 if tmin is None else np.searchsorted(self.times, tmin, side = 'left')
+        stop  = self.times.size if tmax is None else np.searchsorted(self.times, tmax, side = 'right')
+        return slice(start, stop)
+
+    @property
+    def dtype(self):
+        return np.result_type(self._source.dtype, np.float32) if self._source is not None else self._data.dtype
+
+    @property
+    def ntrials(self):
+        return len(self.event_id)
+
+    def _chunks(self, ntrials = None, chunksize = None):
+        '''
+        slices of trials to work through the data in. data that aren't in memory (memory-mapped or lazy) are done in chunks of
+        chunksize trials (by default, about chunkbytes of data at a time), so only one chunk is in memory at once. data in memory are done in one go
+        '''
+        ntrials = self.ntrials if ntrials is None else ntrials
+        if chunksize is None:
+            if self._source is None and not isinstance(self._data, np.memmap):
+                chunksize = ntrials
+            else:
+                chunksize = chunkbytes // (len(self.channels) * self.times.size * np.dtype(self.dtype).itemsize)
+        chunksize = max(chunksize, 1)
+        return [slice(start, min(start+chunksize, ntrials)) for start in range(0, ntrials, chunksize)]
+
+    def apply_baseline(self, baseline, mode = 'subtract', chunksize = None, memmap = None):
+        '''
+        baseline correct each trial and channel, using the (nan-ignoring) mean over the baseline window (bmin, bmax).
+        the data are changed in place. memory-mapped data are done chunksize trials at a time (see load and to_memmap).
+        data that can't be written back to their file (mapped copy-on-write, as io.load does by default, or read-only) are instead
+        corrected a chunk at a time into a new array, in memory or (if memmap is a filename) a .npy file on disk, which the epochs then
+        hold. use io.load(mmap = 'r+') to change the file itself
+
+        mode -- 'subtract' (default) the baseline mean, 'percent' change from the baseline mean, or 'zscore' using the mean and
+                standard deviation of the baseline window
+        '''
+        if mode not in ['subtract', 'percent', 'zscore']:
+            raise ValueError(f"mode must be one of 'subtract', 'percent' or 'zscore', got {mode}")
+        data   = self.data
+        target = data
+        if isinstance(data, np.memmap) and data.mode in ['c', 'copyonwrite', 'r', 'readonly']:
+            #changing copy-on-write pages would copy each of them into memory for good, so write to a new array instead
+            if memmap is None:
+                target = np.empty(shape = data.shape, dtype = data.dtype)
+            else:
+                target = np.lib.format.open_memmap(memmap, mode = 'w+', dtype = data.dtype, shape = data.shape)
+        window = self._timeslice(baseline[0], baseline[1])
+        for chunk in self._chunks(chunksize = chunksize):
+            if target is not data:
+                target[chunk] = data[chunk]
+            _baseline(target[chunk], window, mode)
+        if isinstance(target, np.memmap):
+            target.flush()
+        self.data = target
         return self
 
-def concatenate_epochs(epoch_list):
+    def average(self, by = 'event_id', chunksize = None):
+        '''
+        average the trials of each condition, ignoring nans. conditions are the event_id of each trial (default),
+        or the values of a metadata column (or list of columns). memory-mapped and lazy data are summed chunksize trials at a time.
+        returns a new epochedEyes with one row per condition, with the condition (and number of trials in it) in the metadata
+        '''
+        if isinstance(by, str) and by == 'event_id':
+            cols, keys = ['event_id'], pd.DataFrame(dict(event_id = self.event_id))
+        else:
+            if not isinstance(self.metadata, pd.DataFrame):
+                raise ValueError('no metadata to get the conditions from')
+            cols = [by] if isinstance(by, str) else list(by)
+            keys = self.metadata[cols].reset_index(drop = True)
+        grouped    = keys.groupby(cols, sort = True, dropna = False)
+        codes      = grouped.ngroup().to_numpy()
+        conditions = grouped.size().reset_index(name = 'ntrials')
+
+        ntrials = self.ntrials
+        shape   = (len(self.channels), self.times.size)
+        weights = np.zeros(shape = [len(conditions), ntrials]) #[nconditions x ntrials], 1 for the trials in each condition
+        weights[codes, np.arange(ntrials)] = 1
+        sums    = np.zeros(shape = [len(conditions), shape[0]*shape[1]])
+        counts  = np.zeros(shape = sums.shape)
+        for chunk in self._chunks(chunksize = chunksize):
+            flat = self.get_data(chunk, copy = False).reshape(-1, sums.shape[1])
+            nans = np.isnan(flat)
+            if nans.any(): #sum and count only the samples that aren't nan
+                sums   += weights[:, chunk] @ np.where(nans, 0, flat)
+                counts += weights[:, chunk] @ ~nans
+            else:
+                sums   += weights[:, chunk] @ flat
+                counts += weights[:, chunk].sum(axis = 1, keepdims = True)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            np.divide(sums, counts, out = sums)
+
+        events = conditions[cols].astype(str).agg('/'.join, axis = 1).to_numpy() #label conditions by their values
+        averaged = epochedEyes(data = sums.reshape((len(conditions),) + shape), srate = self.srate,
+                               events = events, times = self.times, channels = self.channels)
+        averaged.metadata = conditions
+        return averaged
+
+    def select_trials(self, trials, memmap = None, chunksize = None):
+        '''
+        new epoch structure with a subset of trials (indices, slice or boolean mask), along with their event ids and metadata.
+        the trials are copied chunksize at a time, into memory or (if memmap is a filename) a .npy file on disk
+        '''
+        trials = np.atleast_1d(np.arange(self.ntrials)[trials])
+        shape  = (trials.size, len(self.channels), self.times.size)
+        if memmap is None:
+            data = np.empty(shape = shape, dtype = self.dtype)
+        else:
+            data = np.lib.format.open_memmap(memmap, mode = 'w+', dtype = self.dtype, shape = shape)
+        for chunk in self._chunks(ntrials = trials.size, chunksize = chunksize):
+            data[chunk] = self.get_data(trials[chunk], copy = False)
+
+        selected = epochedEyes(data = data, srate = self.srate, events = np.asarray(self.event_id)[trials],
+                               times = self.times, channels = self.channels)
+        if isinstance(self.metadata, pd.DataFrame):
+            selected.metadata = self.metadata.iloc[trials].reset_index(drop = True)
+        selected.blocks = self.blocks
+        for attr in ['sources', 'source_trials']: #where the trials came from, if they were concatenated
+            if hasattr(self, attr):
+                setattr(selected, attr, np.asarray(getattr(self, attr))[trials])
+        return selected
+
+    def to_memmap(self, fname, chunksize = None):
+        '''
+        move the data to a memory-mapped .npy file on disk, chunksize trials at a time (lazy epochs are copied out of the continuous data
+        a chunk at a time too). use this to work with epochs that don't fit in memory
+        '''
+        data = np.lib.format.open_memmap(fname, mode = 'w+', dtype = self.dtype, shape = (self.ntrials, len(self.channels), self.times.size))
+        for chunk in self._chunks(chunksize = chunksize):
+            data[chunk] = self.get_data(chunk, copy = False)
+        data.flush()
+        self.data = data
+        return self
+
+    def crop(self, tmin = None, tmax = None):
+        '''
+        keep only the times from tmin to tmax (inclusive). the cropped data are a view, so nothing is copied (and lazy epochs stay lazy)
+        '''
+        keep = self._timeslice(tmin, tmax)
+        if self._source is not None:
+            source = self._source
+            self.data = LazyEpochSource(source.blockdata, source.trialblocks, source.starts + keep.start, keep.stop - keep.start)
+        else:
+            self.data = self._data[..., keep]
+        self.times = self.times[keep]
+        self.tmin  = self.times.min()
+        return self
+
+    def decimate(self, factor, ftype = 'fir'):
+        '''
+        downsample the epochs by an integer factor, low-pass filtering them first so there is no aliasing (see scipy.signal.decimate).
+        the filtered data are divided by the filtered mask of good samples, so nan samples are left out of the filtering (and are still
+        nan afterwards), and the start and end of the epochs aren't pulled towards zero by the filter's zero padding
+        '''
+        data = self.data
+        good = ~np.isnan(data)
+        if good.all(): #the mask is the same for every trial and channel, so only filter it once
+            decimated = sp.signal.decimate(data, factor, ftype = ftype, axis = -1, zero_phase = True)
+            weights   = sp.signal.decimate(np.ones(data.shape[-1]), factor, ftype = ftype, zero_phase = True)
+        else:
+            decimated = sp.signal.decimate(np.where(good, data, 0), factor, ftype = ftype, axis = -1, zero_phase = True)
+            weights   = sp.signal.decimate(good.astype(float), factor, ftype = ftype, axis = -1, zero_phase = True)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            np.divide(decimated, weights, out = decimated)
+        decimated[~good[..., ::factor]] = np.nan
+        self.data  = decimated
+        self.times = self.times[::factor]
+        self.srate = self.srate // factor if self.srate % factor == 0 else self.srate / factor
+        return self
+
+chunkbytes = 2**26 #size (in bytes) of the chunks of trials that out-of-core data are worked through in
+
+def _baseline(data, window, mode):
     '''
-    epochs - list of epoch structures to concatenate
+    baseline correct a [ntrials x nchannels x ntimes] array in place, using the (nan-ignoring) mean over the window (a slice of time)
     '''
-    if len(epoch_list) > 2:
-        raise ValueError('function can only handle concatenating two epoch instances at a time')
-    else:
-        for i, epochs in enumerate(epoch_list):
-            if not isinstance(epochs, epochedEyes):
-                raise TypeError(f'epoch_list[{i}] must be an instance of epochedEyes, got {type(epochs)}')
-        
-        e1, e2 = epoch_list[0], epoch_list[1]
-        #need to check that certain attributes match between files
-        attrs_to_check = ['srate', 'times', 'tmin', 'channels']
-        badattrs = []
+    bline = data[..., window] #view of the baseline window
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) #trials with no data in the baseline just become nan
+        mean = np.nanmean(bline, axis = -1, keepdims = True)
+        if mode == 'zscore':
+            std = np.nanstd(bline, axis = -1, keepdims = True)
+    np.subtract(data, mean, out = data) #broadcast over time
+    if mode == 'percent':
+        np.divide(data, mean, out = data)
+        np.multiply(data, 100, out = data)
+    elif mode == 'zscore':
+        np.divide(data, std, out = data)
+
+class LazyEpochSource():
+    '''
+    the continuous data that epochs are taken from, without copying it.
+    holds references to the channel arrays of each block, and the sample of the block that each epoch starts at.
+    epochs that run over the edge of a block are padded with nan when they are copied out
+    '''
+    def __init__(self, blockdata, trialblocks, starts, ntimes):
+        self.blockdata   = blockdata   #list (per block) of lists of channel arrays
+        self.trialblocks = trialblocks #[ntrials] block that each epoch comes from
+        self.starts      = starts      #[ntrials] sample (in its block) that each epoch starts at
+        self.ntimes      = ntimes
+        self.ntrials     = starts.size
+        self.nchannels   = len(blockdata[0]) if len(blockdata) > 0 else 0
+        self.dtype       = np.result_type(*[x for block in blockdata for x in block]) if self.nchannels > 0 else float
+    
+    def windows(self, iblock, ichannel):
+        '''
+        read-only strided view ([nsamples-ntimes+1 x ntimes]) of every window of ntimes samples in a channel of a block.
+        row starts[i] is epoch i
+        '''
+        return np.lib.stride_tricks.sliding_window_view(self.blockdata[iblock][ichannel], self.ntimes)
+
+    def trial(self, trial):
+        iblock, start = self.trialblocks[trial], self.starts[trial]
+        nsamps = self.blockdata[iblock][0].size
+        if start >= 0 and start + self.ntimes <= nsamps:
+            return [x[start:start+self.ntimes] for x in self.blockdata[iblock]]
+        return list(self.gather([trial])[0])
+
+    def gather(self, trials = None):
+        '''
+        copy a set of trials out of the continuous data, into a [ntrials x nchannels x ntimes] array
+        '''
+        trials = np.arange(self.ntrials) if trials is None else np.atleast_1d(np.arange(self.ntrials)[trials])
+        gathered = np.empty(shape = [trials.size, self.nchannels, self.ntimes], dtype = np.result_type(self.dtype, np.float32))
+        for iblock in np.unique(self.trialblocks[trials]):
+            intrials = np.where(self.trialblocks[trials] == iblock)[0]
+            nsamps = self.blockdata[iblock][0].size
+            inds = self.starts[trials[intrials]][:, None] + np.arange(self.ntimes)[None, :] #[ntrials x ntimes] sample indices for each epoch
+            inblock = np.logical_and(inds >= 0, inds < nsamps)
+            np.clip(inds, 0, nsamps-1, out = inds)
+            blockepochs = np.stack([x[inds] for x in self.blockdata[iblock]], axis = 1)
+            np.copyto(blockepochs, np.nan, where = ~inblock[:, None, :]) #nan any samples beyond the edges of the block
+            gathered[intrials] = blockepochs
+        return gathered
+
+def concatenate_epochs(epoch_list, memmap = None):
+    '''
+    concatenate any number of epoch structures (epochedEyes), in order, into a single one.
+    the output is allocated once, and each input is copied into it once, so this scales linearly with the number of inputs.
+
+    epoch_list  - list of epoch structures to concatenate. srate, times and channels must match between them
+    memmap      - optional filename (.npy) to put the concatenated data in, on disk, rather than in memory
+
+    the new structure records where its trials came from: sources gives the position in epoch_list of the input each trial came from,
+    and source_trials the trial number within that input
+    '''
+    if len(epoch_list) == 0:
+        raise ValueError('no epochs to concatenate')
+    for i, epochs in enumerate(epoch_list):
+        if not isinstance(epochs, epochedEyes):
+            raise TypeError(f'epoch_list[{i}] must be an instance of epochedEyes, got {type(epochs)}')
+
+    #check that certain attributes match between all inputs, before anything is allocated
+    e1 = epoch_list[0]
+    attrs_to_check = ['srate', 'times', 'tmin', 'channels']
+    badattrs = []
+    for i, epochs in enumerate(epoch_list[1:], start = 1):
         for attr in attrs_to_check:
-            same = None
-            a1, a2 = getattr(e1, attr), getattr(e2, attr)
+            a1, a2 = getattr(e1, attr), getattr(epochs, attr)
             if isinstance(a1, (np.ndarray, list)) or isinstance(a2, (np.ndarray, list)):
                 same = np.array_equal(a1, a2)
             else:
                 same = a1==a2
             if not same:
-                badattrs.appen(attr)
-        if len(badattrs) >0 :
-            for attr in badattrs:
-                raise Warning(f'mismatched values in the {attr} attribute between epoch instances')
-            raise ValueError('Attribute values do not match between epoch instances, please check')
-        
-        #if you get this far, things seem ok to proceed
-        d = np.vstack([e1.data, e2.data]) #vertically stack data so its [ntrials x nchannels x ntimes]
-        t = np.hstack([e1.event_id, e2.event_id]) #horizontally concatenate triggers that were presented on each trial
-        m = None
-
-        e1m = isinstance(e1.metadata, pd.DataFrame) #evals as True if metadata is a dataframe
-        e2m = isinstance(e2.metadata, pd.DataFrame) #evals as True if metadata is a dataframe
-        if np.equal([e1m, e2m], True).sum() > 0: #check if there is any metadata available
-            if e1m and not e2m:
-                m = e1.metadata
-            elif not e1m and e2m:
-                m = e2.metadata
-            elif e1m and e2m:
-                m = pd.concat([e1.metadata, e2.metadata]) #concatenate
-        
-        #some attributes can be taken from either data set as they are checked to be equal, so it doesn't matter where its from
-        newepochs = epochedEyes(data = d,   #add in concatenated data
-                                srate = e1.srate, #take sample rate from either, as they are the t
-                                events = t, #assign the triggers
-                                times = e1.times,
-                                channels = e1.channels)
-        if not isinstance(m, type(None)):
-            setattr(newepochs, 'metadata', m) #assign metadata
-        return newepochs
+                badattrs.append(f'{attr} (epoch_list[{i}])')
+    if len(badattrs) > 0:
+        raise ValueError(f'Attribute values do not match between epoch instances, please check: {", ".join(badattrs)}')
+
+    #if you get this far, things seem ok to proceed
+    ntrials = np.array([epochs.ntrials for epochs in epoch_list])
+    stops   = np.cumsum(ntrials)
+    dtype   = np.result_type(*[epochs.dtype for epochs in epoch_list])
+    shape   = (int(stops[-1]), len(e1.channels), e1.times.size)
+    if memmap is None:
+        d = np.empty(shape = shape, dtype = dtype)
+    else:
+        d = np.lib.format.open_memmap(memmap, mode = 'w+', dtype = dtype, shape = shape)
+    for epochs, start, stop in zip(epoch_list, stops - ntrials, stops):
+        d[start:stop] = epochs.get_data(copy = False) #lazy epochs are only copied out of the continuous data here
+    t = np.concatenate([np.asarray(epochs.event_id) for epochs in epoch_list]) #triggers that were presented on each trial
+    
+    m = None
+    if any(isinstance(epochs.metadata, pd.DataFrame) for epochs in epoch_list): #check if there is any metadata available
+        #inputs without metadata get empty rows
+        m = pd.concat([epochs.metadata if isinstance(epochs.metadata, pd.DataFrame) else pd.DataFrame(index = range(n))
+                       for epochs, n in zip(epoch_list, ntrials)], ignore_index = True)
+
+    #some attributes can be taken from any data set as they are checked to be equal, so it doesn't matter where its from
+    newepochs = epochedEyes(data = d,   #add in concatenated data
+                            srate = e1.srate,
+                            events = t, #assign the triggers
+                            times = e1.times,
+                            channels = e1.channels)
+    newepochs.metadata = m
+    newepochs.sources = np.repeat(np.arange(len(epoch_list)), ntrials)    #input each trial came from
+    newepochs.source_trials = np.arange(shape[0]) - np.repeat(stops - ntrials, ntrials) #trial number within its input
+    return newepochs
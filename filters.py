@@ -0,0 +1,136 @@
+'''
+filters that run along the time axis of stacked signals (e.g. all the channels of a block, or all trials of some epochs) in one call.
+their cost doesn't grow with the width of the filter, and nan samples (e.g. blinks that weren't interpolated) are left out of the
+filtering rather than spreading into the samples around them. nan samples stay nan in the output
+'''
+import numpy as np
+import scipy as sp
+
+fft_radius = 64 #gaussians with a kernel wider than this (either side of the centre) are run as an fft convolution
+
+def _window_sums(values, width):
+    '''
+    sums of values over a window of width samples centred on each sample (along the last axis), from a cumulative sum.
+    the window is centred as np.convolve(mode = 'same') centres it, and is cut off at the ends of the data
+    '''
+    nsamps = values.shape[-1]
+    before, after = width//2, (width-1)//2 + 1
+    if values.dtype.kind == 'b':
+        dtype = np.int32 if nsamps < 2**31 else np.int64 #counts of a mask, so half the memory when they fit
+    else:
+        dtype = np.int64 if values.dtype.kind in 'ui' else np.float64
+    #running sum up to each sample, padded so the window edges can be taken as shifted slices
+    sums = np.zeros(shape = values.shape[:-1] + (before + nsamps + 1 + after,), dtype = dtype)
+    np.cumsum(values, axis = -1, out = sums[..., before+1:before+nsamps+1])
+    sums[..., before+nsamps+1:] = sums[..., before+nsamps:before+nsamps+1]
+    return sums[..., before+after:before+after+nsamps] - sums[..., :nsamps]
+
+def _normalized(filt, signals, axis):
+    '''
+    run a linear filter (filt, which works along the last axis) on signals with nans, as a normalized convolution:
+    the filtered signals (with nans set to 0) are divided by the filtered mask of good samples
+    '''
+    signals = np.moveaxis(np.asarray(signals), axis, -1)
+    if not np.issubdtype(signals.dtype, np.floating):
+        signals = signals.astype(float)
+    good = ~np.isnan(signals)
+    if good.all():
+        filtered = filt(signals)
+        weights  = filt(np.ones(signals.shape[-1], dtype = signals.dtype))
+    else:
+        filtered = filt(np.where(good, signals, 0))
+        weights  = filt(good.astype(signals.dtype))
+        weights[~good] = np.nan #don't fill in missing samples
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        filtered = np.divide(filtered, weights, out = filtered).astype(signals.dtype, copy = False)
+    return np.moveaxis(filtered, -1, axis)
+
+def boxcar(signals, width, axis = -1):
+    '''
+    moving average over a window of width samples, from a cumulative sum (so the cost doesn't depend on the width).
+    the window is centred on each sample as np.convolve(mode = 'same') centres it, and at the ends of the data it is the average of
+    the samples there are
+    '''
+    width = int(width)
+    def filt(values):
+        if width <= 1:
+            return values.copy()
+        offset = values.mean(axis = -1, keepdims = True) #sum differences from the mean, to keep the running sums small
+        return _window_sums(values - offset, width) + offset * _window_sums(np.ones(values.shape[-1]), width)
+    return _normalized(filt, signals, axis)
+
+def gaussian_kernel(sigma, truncate = 4.0):
+    '''
+    gaussian kernel with standard deviation sigma, cut off at truncate standard deviations (the same kernel as scipy.ndimage.gaussian_filter1d)
+    '''
+    radius = int(truncate * sigma + 0.5)
+    x = np.arange(-radius, radius+1)
+    kernel = np.exp(-0.5 * (x/sigma)**2)
+    return kernel / kernel.sum()
+
+def gaussian(signals, sigma, axis = -1, truncate = 4.0, out = None, chunksize = 2**16):
+    '''
+    gaussian smoothing with standard deviation sigma (samples), reflecting the data at the start and end as scipy.ndimage.gaussian_filter1d does.
+    wide kernels (more than fft_radius samples either side) are run as an overlap-add fft convolution, so the cost stays flat as sigma grows.
+
+    out -- array (the shape of signals) to write the result into, which can be signals itself to smooth in place. the signals are then
+           smoothed chunksize samples at a time (with the kernel's width of samples either side), so only a chunk's worth of temporary
+           arrays is made however long they are
+    '''
+    kernel = gaussian_kernel(sigma, truncate)
+    radius = kernel.size // 2
+    def filt(values):
+        if radius <= fft_radius:
+            return sp.ndimage.gaussian_filter1d(values, sigma = sigma, axis = -1, truncate = truncate, mode = 'reflect')
+        padding = [(0, 0)] * (values.ndim-1) + [(radius, radius)]
+        padded = np.pad(values, padding, mode = 'symmetric') #'symmetric' in numpy is 'reflect' in scipy.ndimage
+        return sp.signal.oaconvolve(padded, kernel.reshape((1,) * (values.ndim-1) + (-1,)), mode = 'valid', axes = -1)
+    if out is None:
+        return _normalized(filt, signals, axis)
+    return _chunked(lambda values: _normalized(filt, values, -1), signals, radius, out, axis, max(chunksize, radius))
+
+def _chunked(func, signals, radius, out, axis, chunksize):
+    '''
+    run a filter (func, along the last axis) over chunks of chunksize samples of signals, each with radius samples of the signals either
+    side so the result is the same as filtering them in one go, and write it into out. each chunk is only written once the next one
+    has been filtered (which needs the samples before it), so out can be signals itself
+    '''
+    signals, target = np.moveaxis(np.asarray(signals), axis, -1), np.moveaxis(out, axis, -1)
+    nsamps  = signals.shape[-1]
+    pending = None #the filtered chunk waiting to be written, and where it goes
+    for start in range(0, nsamps, chunksize):
+        stop = min(start+chunksize, nsamps)
+        lo, hi = max(start-radius, 0), min(stop+radius, nsamps)
+        filtered = func(signals[..., lo:hi])[..., start-lo:stop-lo]
+        if pending is not None:
+            target[..., pending[1]] = pending[0]
+        pending = (filtered, slice(start, stop))
+    if pending is not None:
+        target[..., pending[1]] = pending[0]
+    return out
+
+def butterworth(signals, cutoff, srate, order = 4, axis = -1):
+    '''
+    zero-phase (forwards and backwards) butterworth low-pass filter, as second-order sections.
+
+    cutoff -- cutoff frequency (Hz)
+    srate  -- sampling rate of the signals (Hz)
+    order  -- order of the filter (run twice, so the attenuation is doubled)
+
+    nan gaps are linearly interpolated over before filtering (the filter's impulse response has negative lobes, so a normalized
+    convolution can blow up next to long gaps), then set back to nan
+    '''
+    sos = sp.signal.butter(order, cutoff, btype = 'low', fs = srate, output = 'sos')
+    signals = np.moveaxis(np.asarray(signals), axis, -1)
+    signals = np.array(signals, dtype = signals.dtype if signals.dtype.kind == 'f' else float, order = 'C') #a copy, to fill the gaps in
+    nsamps = signals.shape[-1]
+    bad = np.isnan(signals)
+    flat, flatbad = signals.reshape(-1, nsamps), bad.reshape(-1, nsamps)
+    samples = np.arange(nsamps)
+    for isig in np.flatnonzero(flatbad.any(axis = 1) & ~flatbad.all(axis = 1)):
+        good = ~flatbad[isig]
+        flat[isig, ~good] = np.interp(samples[~good], samples[good], flat[isig, good])
+    padlen = min(3 * (2 * len(sos) + 1), nsamps - 1) #scipy's default, unless the signals are too short for it
+    filtered = sp.signal.sosfiltfilt(sos, signals, axis = -1, padlen = padlen).astype(signals.dtype, copy = False)
+    filtered[bad] = np.nan
+    return np.moveaxis(filtered, -1, axis)
@@ -0,0 +1,77 @@
+import numpy as np
+import time
+import logging
+import functools
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__.rpartition('.')[0] or __name__) #the package logger, which is silent unless logging is set up
+
+_callbacks = []
+
+def add_callback(callback):
+    '''
+    call callback(record) after every stage that is recorded. record is a dict with the stage name, the time it took (seconds),
+    the number of samples, samples_per_s, bytes (change in the memory held by the block of data) and anything else the stage logs
+    (e.g. nblinks for identify_blinks)
+    '''
+    _callbacks.append(callback)
+
+def remove_callback(callback):
+    _callbacks.remove(callback)
+
+def _nbytes(data):
+    '''
+    memory held by the arrays of a block of data (class: EyeHolder)
+    '''
+    if data is None:
+        return 0
+    nbytes = 0 if data.channels is None else data.channels.nbytes
+    for value in [getattr(data, 'trackertime', None), getattr(data, 'time', None)] + list(data.attrs.values()):
+        if isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+    return nbytes
+
+def record(name, data = None, elapsed = None, nbytes = 0, **extra):
+    '''
+    record that a stage has run on a block of data: the record is stored in data.info['stages'][name], logged (at INFO level)
+    and passed to any callbacks
+    '''
+    nsamples = getattr(data, 'trackertime', np.zeros(0)).size if data is not None else extra.pop('nsamples', 0)
+    rec = dict(stage = name, time = elapsed, nsamples = nsamples,
+               samples_per_s = nsamples / elapsed if elapsed else None, bytes = nbytes, **extra)
+    if data is not None:
+        data.info.setdefault('stages', dict())[name] = rec
+    if logger.isEnabledFor(logging.INFO):
+        details = ''.join([f', {key} {value}' for key, value in extra.items()])
+        logger.info(f'{name}: {elapsed:.4f}s, {nsamples} samples, {nbytes/1e6:+.1f} MB{details}')
+    for callback in _callbacks:
+        callback(rec)
+    return rec
+
+@contextmanager
+def stage(name, data = None):
+    '''
+    time a stage run on a block of data (see record). yields a dict that extra things to record can be added to
+    '''
+    extra  = dict()
+    before = _nbytes(data)
+    start  = time.perf_counter()
+    yield extra
+    elapsed = time.perf_counter() - start
+    record(name, data, elapsed, _nbytes(data) - before, **extra)
+
+def timed(name, summary = None):
+    '''
+    decorator for the functions that run a step on a single block of data (class: EyeHolder, the first argument), to record the stage.
+    summary(data) can return a dict of extra things to record after the step has run
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(data, *args, **kwargs):
+            with stage(name, data) as extra:
+                data = func(data, *args, **kwargs)
+                if summary is not None:
+                    extra.update(summary(data))
+            return data
+        return wrapper
+    return decorator
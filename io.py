@@ -1,91 +1,442 @@
 import numpy as np
 import pickle
+import json
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from io import StringIO
 from .raw import rawEyes
-from .classes import EyeHolder
+from .epochs import epochedEyes
+from .classes import EyeHolder, EyeTriggers, Blinks, EventTable, Saccades, Fixations, ChannelStore, precisions
+from . import instrument
 
+logger = logging.getLogger(__name__)
 
-def parse_eyes(fname, srate = 1000):#, binocular = False):
+
+def parse_eyes(fname, srate = 1000, lazy = False, precision = 'double'):#, binocular = False):
+    '''
+    read an eyelink asc file into a rawEyes object
+
+    fname     -- path to the asc file
+    srate     -- sampling rate of the recording
+    lazy      -- if True, only index the START/END blocks of the file (using the sidecar index file if there is one).
+                 a block is then parsed the first time it is accessed through data[iblock]
+    precision -- 'double' (default) keeps signals as float64. 'single' keeps them as float32, and the samples to interpolate over
+                 as boolean masks rather than nan copies of the pupil trace, which roughly halves the memory used (see classes.precisions)
+    '''
+    if precision not in precisions:
+        raise ValueError(f'precision must be one of {list(precisions)}, got {precision}')
     # if binocular:
     #     eyedata = _parse_binocular(fname, srate)
     # elif not binocular:
     #     eyedata = _parse_monocular(fname, srate)
-    eyedata = _parse_eyes(fname, srate)
+    if lazy:
+        eyedata = _open_lazy(fname, srate, precision)
+    else:
+        eyedata = _parse_eyes(fname, srate, precision = precision)
     
     return eyedata
 
-def _parse_eyes(fname, srate):
-    ncols_search = [6, 9] #if monocular search for 6 columns, if binocular search for 9 columns
-    d = open(fname, 'r')
-    raw_d = d.readlines()
-    d.close()
-    starts = [x for x in range(len(raw_d)) if raw_d[x] != '\n' and raw_d[x].split()[0] == 'START']
-    fstart = starts[0]
-    raw_d = raw_d[fstart:] #remove calibration info at the beginning of the file opening
-    
-    starts = [x for x in range(len(raw_d)) if raw_d[x] != '\n' and raw_d[x].split()[0] == 'START']
-    ends   = [x for x in range(len(raw_d)) if raw_d[x] != '\n' and raw_d[x].split()[0] == 'END']
+def _parse_eyes(fname, srate, chunksize = 2**24, precision = 'double'):
+    '''
+    single pass, streaming parser for eyelink asc files.
 
-    # if len(ends) == len(starts)-1:
-        # print(f'')
-    
-    eyedata = rawEyes(nblocks=len(starts), srate = srate)
+    the file is read in chunks of roughly `chunksize` bytes. within a START/END block, sample lines (starting with the tracker time)
+    are sorted from MSG/event lines as they come in, and converted straight into preallocated float arrays once per chunk
+    '''
+    eyedata = rawEyes(nblocks = 0, srate = srate)
     eyedata.binocular=True #log that this *is* a binocular recording
     
     # by handling binocular/monocular separately for each block of the data
     # you can handle situations where you change binocular/monocular between task blocks
+    block = None
+    with open(fname, 'rb') as handle:
+        for lines in iter(lambda: handle.readlines(chunksize), []):
+            i = 0
+            while i < len(lines):
+                if block is None:
+                    if lines[i].startswith(b'START'): #anything outside of a recording block (e.g. calibration info) is skipped
+                        block = _BlockReader(lines[i], precision = precision)
+                        logger.info(f'parsing block {eyedata.nblocks+1}, recording is {["monocular", "binocular"][int(block.binocular)]}')
+                    i += 1
+                else:
+                    i = block.feed(lines, i)
+                    if block.done:
+                        segdata = block.to_eyeholder()
+                        if eyedata.fsamp is None and segdata.trackertime.size > 0:
+                            eyedata.fsamp = int(segdata.trackertime[0]) #get starting sample number
+                        eyedata.data.append(segdata)
+                        eyedata.nblocks += 1
+                        block = None
+            if block is not None:
+                block.flush() #convert the samples of this chunk before reading the next one
+    if block is not None:
+        logger.warning(f'block {eyedata.nblocks+1} has no END message (the file may be truncated), and has been dropped')
+    if eyedata.nblocks == 0:
+        raise ValueError(f'no recording blocks (START/END) found in {fname}')
+    return eyedata
+
+def index_blocks(fname, save_index = True, chunksize = 2**24):
+    '''
+    index the START/END blocks of an asc file in a single pass, without parsing any samples.
+
+    for each block this logs the byte offset of the START line, the byte offset just after the END line,
+    the eyes recorded, the number of sample lines and the tracker time of the first sample.
+    if save_index is True, the index is saved to a json sidecar file next to the asc file (see _index_fname) so it can be reused.
+    if the sidecar can't be written (e.g. the directory is read-only) a warning is logged and the index is still returned
+    '''
+    index = []
+    block = None
+    offset = 0
+    with open(fname, 'rb') as handle:
+        for lines in iter(lambda: handle.readlines(chunksize), []):
+            for line in lines:
+                if block is None:
+                    if line.startswith(b'START'):
+                        startmsg = line.split()
+                        eyes = [eye for eye in ['left', 'right'] if eye.upper().encode() in startmsg]
+                        block = dict(offset = offset, end = None, eyes_recorded = eyes, binocular = len(eyes) == 2,
+                                     nsamples = 0, firstsample = None)
+                elif line[:1].isdigit():
+                    if block['nsamples'] == 0:
+                        block['firstsample'] = float(line.split(maxsplit = 1)[0])
+                    block['nsamples'] += 1
+                elif line.startswith(b'END'):
+                    block['end'] = offset + len(line)
+                    index.append(block)
+                    block = None
+                offset += len(line)
     
-    nsegments = len(starts)
-    for iseg in range(nsegments):
-        print(f'parsing block {iseg+1}/{nsegments}')
-        istart, iend = starts[iseg], ends[iseg]
-        rdata = raw_d[istart:iend+1]
-        startmsg = rdata[0].split() #parse the start message as this tells you how many eyes are recorded
-        if 'LEFT' in startmsg and 'RIGHT' in startmsg:
-            binoc = True
-            print('-- block recording is binocular')
-        else:
-            binoc = False
-            print('-- block recording is monocular')
-        data = rdata[7:] #cut out some of the nonsense before recording starts
-        idata = [x for x in data if len(x.split()) == ncols_search[int(binoc)]]
-        msgs  = [x for x in data if len(x.split()) != ncols_search[int(binoc)]]
-        idata = np.asarray([x.split() for x in idata])[:, :-1] #drop the last column as it is nonsense (it's just '.....')
-        if iseg == 0:
-            fsamp = int(idata[0][0]) #get starting sample number
-            eyedata.fsamp = fsamp
-        #missing data is coded as '.' in the asc file - we need to make this usable but easily identifiable
-        idata = np.where(idata=='.', 'NaN', idata) #set this missing data to a string nan that numpy can handle easily
-        idata = idata.copy().astype(float) #convert into numbers now
+    if save_index:
+        stat = os.stat(fname)
+        try:
+            with open(_index_fname(fname), 'w') as handle:
+                json.dump(dict(size = stat.st_size, mtime_ns = stat.st_mtime_ns, blocks = index), handle)
+        except OSError as err: #e.g. a read-only data directory. the index is only a cache, so carry on without it
+            logger.warning(f'could not save the block index of {fname} ({err}), it will be rebuilt next time')
+    return index
+
+def load_index(fname):
+    '''
+    read the block index of an asc file from its sidecar file. returns None if there isn't one, or if the asc file has changed since it was indexed
+    '''
+    if not os.path.exists(_index_fname(fname)):
+        return None
+    with open(_index_fname(fname), 'r') as handle:
+        saved = json.load(handle)
+    stat = os.stat(fname)
+    if saved['size'] != stat.st_size or saved['mtime_ns'] != stat.st_mtime_ns:
+        return None
+    return saved['blocks']
+
+def _index_fname(fname):
+    return f'{fname}.index.json'
+
+def _open_lazy(fname, srate, precision = 'double'):
+    index = _get_index(fname)
+    eyedata = rawEyes(nblocks = len(index), srate = srate)
+    eyedata.binocular = True
+    eyedata.data = LazyBlocks(fname, index, precision)
+    if len(index) > 0 and index[0]['firstsample'] is not None:
+        eyedata.fsamp = int(index[0]['firstsample'])
+    return eyedata
+
+def _parse_block(fname, block, chunksize = 2**24, precision = 'double'):
+    '''
+    parse a single START/END block of an asc file, given its entry in the block index
+    '''
+    with open(fname, 'rb') as handle:
+        handle.seek(block['offset'])
+        reader = _BlockReader(handle.readline(), nsamples = max(block['nsamples'], 1), precision = precision)
+        while not reader.done:
+            lines = handle.readlines(chunksize)
+            if len(lines) == 0:
+                raise ValueError(f'reached the end of {fname} before the END of the block starting at byte {block["offset"]}')
+            reader.feed(lines)
+            reader.flush()
+    return reader.to_eyeholder()
+
+class LazyBlocks():
+    '''
+    list-like container of the blocks of an asc file, that only parses a block when it is first accessed
+    '''
+    def __init__(self, fname, index, precision = 'double'):
+        self.fname  = fname
+        self.index  = index
+        self.blocks = [None] * len(index)
+        self.precision = precision
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, iblock):
+        if isinstance(iblock, slice):
+            return [self[i] for i in range(*iblock.indices(len(self)))]
+        if self.blocks[iblock] is None:
+            self.blocks[iblock] = _parse_block(self.fname, self.index[iblock], precision = self.precision)
+        return self.blocks[iblock]
+
+    def __setitem__(self, iblock, blockdata):
+        self.blocks[iblock] = blockdata
+
+    def __iter__(self):
+        for iblock in range(len(self)):
+            yield self[iblock]
+
+    def append(self, blockdata):
+        self.blocks.append(blockdata)
+        self.index.append(None)
+
+    def is_loaded(self, iblock):
+        return self.blocks[iblock] is not None
+
+def parse_many(fnames, srate = 1000, n_jobs = None, split_size = 2**28, precision = 'double'):
+    '''
+    parse a list of asc files in parallel, across a pool of processes.
+
+    fnames      -- list of paths to asc files
+    srate       -- sampling rate of the recordings
+    n_jobs      -- number of processes to use. defaults to the number of cpus. if 1, files are parsed one by one in this process
+    split_size  -- files larger than this (in bytes) are split up by their START/END blocks (see index_blocks), and the blocks parsed in parallel
+    precision   -- 'double' or 'single' (see parse_eyes)
+
+    returns:
+        data    -- list of rawEyes, in the same order as fnames (None where a file could not be parsed)
+        errors  -- list of the same length, with the exception raised while parsing each file (None if it parsed without problems)
+    
+    one bad file doesn't stop the rest of the batch, so check errors once it's done
+    '''
+    fnames = list(fnames)
+    data   = [None] * len(fnames)
+    errors = [None] * len(fnames)
+    if n_jobs == 1:
+        for ifile, fname in enumerate(fnames):
+            try:
+                data[ifile] = _parse_eyes(fname, srate, precision = precision)
+            except Exception as err:
+                errors[ifile] = err
+        return data, errors
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+        indexjobs, filejobs, blockjobs = dict(), dict(), dict()
+        for ifile, fname in enumerate(fnames):
+            try:
+                split = os.path.getsize(fname) > split_size
+            except OSError as err:
+                errors[ifile] = err
+                continue
+            if split:
+                indexjobs[ifile] = pool.submit(_get_index, fname)
+            else:
+                filejobs[ifile] = pool.submit(_parse_eyes, fname, srate, precision = precision)
         
-        segdata             = EyeHolder()
-        segdata.binocular   = binoc
-        if 'LEFT' in startmsg:
-            segdata.eyes_recorded.append('left')
-        if 'RIGHT' in startmsg:
-            segdata.eyes_recorded.append('right')
+        for ifile, job in indexjobs.items(): #split large files up by block once they're indexed
+            try:
+                index = job.result()
+                if len(index) == 0:
+                    raise ValueError(f'no recording blocks (START/END) found in {fnames[ifile]}')
+                blockjobs[ifile] = [pool.submit(_parse_block, fnames[ifile], block, precision = precision) for block in index]
+            except Exception as err:
+                errors[ifile] = err
         
-        segdata.trackertime = idata[:,0]
-        segdata.time        = np.subtract(segdata.trackertime, segdata.trackertime[0]) #time relative to the first sample
+        for ifile, job in filejobs.items():
+            try:
+                data[ifile] = job.result()
+            except Exception as err:
+                errors[ifile] = err
+        for ifile, jobs in blockjobs.items():
+            try:
+                data[ifile] = _blocks_to_raw([job.result() for job in jobs], srate)
+            except Exception as err:
+                errors[ifile] = err
+    return data, errors
+
+def _get_index(fname):
+    index = load_index(fname)
+    if index is None:
+        index = index_blocks(fname)
+    return index
+
+def _blocks_to_raw(blocks, srate):
+    '''
+    put parsed blocks (EyeHolder) of a file together into a rawEyes object
+    '''
+    eyedata = rawEyes(nblocks = len(blocks), srate = srate)
+    eyedata.binocular = True
+    eyedata.data = list(blocks)
+    sampled = [x for x in blocks if x.trackertime.size > 0]
+    if len(sampled) > 0:
+        eyedata.fsamp = int(sampled[0].trackertime[0]) #get starting sample number
+    return eyedata
+
+class _SampleBuffer():
+    '''
+    preallocated arrays that sample lines are converted into, growing if they need to:
+    the tracker time ([nsamples]), and the data columns ([ncols-1 x nsamples], so each channel is a contiguous row)
+    '''
+    def __init__(self, ncols, capacity = 2**16, dtype = np.float64):
+        self.times = np.empty(shape = [capacity])
+        self.array = np.empty(shape = [ncols-1, capacity], dtype = dtype)
+        self.n     = 0
+
+    def extend(self, rows):
+        nrows = rows.shape[0]
+        if self.n + nrows > self.times.size: #grow the buffer by (at least) doubling it
+            capacity = max(self.n + nrows, 2*self.times.size)
+            newtimes, newarray = np.empty(shape = [capacity]), np.empty(shape = [self.array.shape[0], capacity], dtype = self.array.dtype)
+            newtimes[:self.n], newarray[:, :self.n] = self.times[:self.n], self.array[:, :self.n]
+            self.times, self.array = newtimes, newarray
+        self.times[self.n:self.n+nrows] = rows[:, 0]
+        self.array[:, self.n:self.n+nrows] = rows[:, 1:].T
+        self.n += nrows
+
+    def columns(self):
+        if self.n < self.times.size:
+            #trim to the number of samples so each channel is contiguous in memory
+            self.times, self.array = self.times[:self.n].copy(), self.array[:, :self.n].copy()
+        return self.times, self.array
+
+class _BlockReader():
+    '''
+    collects the lines of a single START/END block of an asc file
+    '''
+    def __init__(self, startline, nsamples = None, precision = 'double'):
+        startmsg = startline.split() #parse the start message as this tells you how many eyes are recorded
+        self.eyes_recorded = []
+        if b'LEFT' in startmsg:
+            self.eyes_recorded.append('left')
+        if b'RIGHT' in startmsg:
+            self.eyes_recorded.append('right')
+        self.binocular  = len(self.eyes_recorded) == 2
+        self.ncols      = [4, 7][int(self.binocular)] #tracker time, then x, y and pupil for each eye
+        self.precision  = precision
+        dtype = precisions[precision]['signals']
+        self.samples    = _SampleBuffer(self.ncols, dtype = dtype) if nsamples is None else _SampleBuffer(self.ncols, nsamples, dtype = dtype)
+        self.samplelines = []
+        self.msglines    = []
+        self.eventlines  = [] #the tracker's own blink, saccade and fixation events
+        self.done        = False #set once the END of the block has been read
+        self.started     = time.perf_counter()
+
+    def feed(self, lines, i = 0):
+        '''
+        sort lines[i:] into sample, MSG and event (see _event_lines) lines until the END of the block is reached.
+        returns the position in lines to carry on reading from
+        '''
+        addsample, addmsg, addevent = self.samplelines.append, self.msglines.append, self.eventlines.append
+        for i in range(i, len(lines)):
+            line = lines[i]
+            if line[:1].isdigit(): #sample lines start with the tracker time
+                addsample(line)
+            elif line.startswith(b'MSG'):
+                addmsg(line)
+            elif line.startswith(_event_lines):
+                addevent(line)
+            elif line.startswith(b'END'):
+                self.done = True
+                return i+1
+        return len(lines)
+
+    def flush(self):
+        '''
+        convert the sample lines read so far into floats, and add them to the sample buffer
+        '''
+        if len(self.samplelines) > 0:
+            self.samples.extend(_samples_to_array(self.samplelines, self.ncols))
+            self.samplelines = []
+
+    def to_eyeholder(self):
+        self.flush()
+        trackertime, idata = self.samples.columns()
+        
+        segdata             = EyeHolder()
+        segdata.binocular   = self.binocular
+        segdata.eyes_recorded = self.eyes_recorded
+        segdata.trackertime = _tracker_clock(trackertime)
+        segdata.info['precision'] = self.precision
+        segdata.time        = np.subtract(segdata.trackertime, segdata.trackertime[:1]) #time relative to the first sample (empty if the block has no samples)
         
         if segdata.binocular: #if binocular, add both eyes
             colsadd = ['xpos_l', 'ypos_l', 'pupil_l', 'xpos_r', 'ypos_r', 'pupil_r']
-            for icol in range(len(colsadd)):
-                setattr(segdata, colsadd[icol], idata[:,icol+1])
-        if not segdata.binocular : #we'll log which eye was recorded for the block, but going to harmonise this down the line by saving with one name only regardless of eye
+        else: #we'll log which eye was recorded for the block, but going to harmonise this down the line by saving with one name only regardless of eye
             colsadd = ['xpos', 'ypos', 'pupil']
-            for icol in range(len(colsadd)):
-                setattr(segdata, colsadd[icol], idata[:, icol+1])
+        segdata.channels = ChannelStore.from_array(idata, colsadd) #the sample buffer becomes the channel store, without copying it
         
         #some parsing of triggers etc
-        msgs = [x.split() for x in msgs]
-        if len([x for x in msgs if len(x)==0])>0: #check if we have any items that are empty and drop if so
-            msgs = [x for x in msgs if len(x)>0]
-        triggers = np.array([x for x in msgs if x[0] == 'MSG'])
-        segdata.triggers.timestamp = triggers[:,1].astype(int)
-        segdata.triggers.event_id  = triggers[:,2]
-        
-        eyedata.data.append(segdata)
-    return eyedata
+        msgs = [x.split(maxsplit = 2) for x in self.msglines]
+        msgs = [x for x in msgs if len(x) > 1]
+        payload = [x[2].decode().strip() if len(x) > 2 else '' for x in msgs] #the full message after the timestamp
+        segdata.triggers = EyeTriggers(timestamp = [int(x[1]) for x in msgs],
+                                       event_id  = [x.split(maxsplit = 1)[0] if len(x) > 0 else '' for x in payload],
+                                       message   = payload)
+        segdata.triggers.get_samples(segdata.trackertime) #work out the sample index of each trigger now
+        if len(self.eventlines) > 0 and segdata.trackertime.size > 0: #files exported without events don't get any, so identify_blinks(method = 'tracker') knows to fall back
+            suffixes = ['_l', '_r'] if segdata.binocular else ['']
+            for suffix, eye in zip(suffixes, segdata.eyes_recorded):
+                for attr, events in _events_to_arrays(self.eventlines, eye, segdata.trackertime[-1]).items():
+                    setattr(segdata, attr + suffix, events)
+        instrument.record('parse', segdata, elapsed = time.perf_counter() - self.started, nbytes = instrument._nbytes(segdata),
+                          ntriggers = len(segdata.triggers))
+        return segdata
+
+#event lines kept by the parser: the end of each event (which has all of its fields), and the start of blinks in case one is still going at
+#the END of a block. the fields of each kind of event are kept as structured arrays, with times in tracker time (ms)
+_event_lines  = (b'EBLINK', b'ESACC', b'EFIX', b'SBLINK')
+_event_fields = dict(
+    tracker_blinks    = (b'EBLINK', [('start', np.int64), ('end', np.int64), ('dur', np.int64)]),
+    tracker_saccades  = (b'ESACC',  [('start', np.int64), ('end', np.int64), ('dur', np.int64), ('startx', float), ('starty', float),
+                                     ('endx', float), ('endy', float), ('ampl', float), ('peakvel', float)]),
+    tracker_fixations = (b'EFIX',   [('start', np.int64), ('end', np.int64), ('dur', np.int64), ('x', float), ('y', float), ('pupil', float)]),
+)
+
+def _events_to_arrays(lines, eye, lasttime):
+    '''
+    structured arrays of the blink, saccade and fixation events of one eye (e.g. 'left') from the event lines of a block. missing values
+    ('.') are nan. a blink that hasn't ended by the end of the block (an SBLINK without its EBLINK) is taken to run to the last sample (lasttime)
+    '''
+    letter = eye[0].upper().encode()
+    split  = [x.split() for x in lines]
+    split  = [x for x in split if len(x) > 2 and x[1] == letter]
+    arrays = dict()
+    for attr, (kind, fields) in _event_fields.items():
+        rows = [x[2:2+len(fields)] for x in split if x[0] == kind and len(x) >= 2+len(fields)]
+        values = np.array(rows, dtype = bytes).reshape(-1, len(fields))
+        values = np.where(values == b'.', b'nan', values).astype(float)
+        arrays[attr] = np.zeros(len(rows), dtype = fields)
+        for ifield, (name, dtype) in enumerate(fields):
+            arrays[attr][name] = values[:, ifield]
+    blinks = arrays['tracker_blinks']
+    opened = [int(x[2]) for x in split if x[0] == b'SBLINK']
+    if len(opened) > 0 and (blinks.size == 0 or opened[-1] > blinks['start'][-1]):
+        lasttime = int(lasttime)
+        arrays['tracker_blinks'] = np.append(blinks, np.array([(opened[-1], lasttime, lasttime - opened[-1] + 1)], dtype = blinks.dtype))
+    return arrays
+
+def _tracker_clock(trackertime):
+    '''
+    tracker time as int64 (it counts ms, so is integer unless recorded faster than 1kHz), or float64 if it isn't integer.
+    a block without samples gets an empty int64 clock, like the blocks around it
+    '''
+    if np.array_equal(trackertime, np.round(trackertime)):
+        return trackertime.astype(np.int64)
+    return trackertime
+
+def _samples_to_array(lines, ncols):
+    '''
+    convert a list of asc sample lines into an [nsamples x ncols] float array.
+    only the first ncols columns are kept, which drops the input and flag (e.g. '.....') columns at the end of the line
+    '''
+    rows = [x.split()[:ncols] for x in lines]
+    rows = [x for x in rows if len(x) == ncols]
+    #missing data is coded as '.' in the asc file - make it nan so it's usable but easily identifiable
+    text = b' ' + b' '.join([b' '.join(x) for x in rows]) + b' '
+    text = text.replace(b' . ', b' nan ').replace(b' . ', b' nan ') #twice, as neighbouring missing values share a space
+    idata = np.fromstring(text, dtype = float, sep = ' ')
+    if idata.size != len(rows) * ncols:
+        raise ValueError(f'could not convert sample lines to numbers, expected {len(rows)*ncols} values and got {idata.size}')
+    return idata.reshape(len(rows), ncols)
 
 def _parse_monocular(fname, srate):
     #by default it's just going to look for stop/starts in the data file
@@ -103,7 +454,7 @@ def _parse_monocular(fname, srate):
     eyedata.binocular = False #log that this is *not* a binocular recording
     nsegments = len(starts)
     for iseg in range(nsegments):
-        print(f'parsing block {iseg+1}/{nsegments}')
+        logger.info(f'parsing block {iseg+1}/{nsegments}')
         istart, iend = starts[iseg], ends[iseg]
         data = raw_d[istart:iend+1]
         data = data[7:] #cut out some of the nonsense before recording starts
@@ -125,7 +476,7 @@ def _parse_monocular(fname, srate):
         segdata.xpos        = idata[:,1]
         segdata.ypos        = idata[:,2]
         segdata.pupil       = idata[:,3]
-        segdata.time        = np.subtract(segdata.trackertime, segdata.trackertime[0]) #time relative to the first sample
+        segdata.time        = np.subtract(segdata.trackertime, segdata.trackertime[:1]) #time relative to the first sample (empty if the block has no samples)
         
         #some parsing of triggers etc
         msgs = [x.split() for x in msgs]
@@ -136,12 +487,177 @@ def _parse_monocular(fname, srate):
         eyedata.data.append(segdata)
     return eyedata # type: ignore
 
-def save(obj, fname):
+def save(obj, fname, format = 'columnar'):
+    '''
+    save a rawEyes or epochedEyes object to disk
+
+    format -- 'columnar' (default) writes a directory with one .npy file per channel (per block, for rawEyes),
+              and a json manifest (manifest.json) with the info, triggers, blinks and other attributes.
+              the channels can then be memory-mapped and loaded selectively (see load)
+              'pickle' pickles the whole object into a single file
+    '''
+    if format == 'pickle':
         with open(fname, 'wb') as handle:
             pickle.dump(obj, handle)
+    elif format == 'columnar':
+        os.makedirs(fname, exist_ok = True)
+        if isinstance(obj, rawEyes):
+            manifest = _save_raw(obj, fname)
+        elif isinstance(obj, epochedEyes):
+            manifest = _save_epochs(obj, fname)
+        else:
+            raise TypeError(f'can only save rawEyes or epochedEyes objects in the columnar format, got {type(obj)}')
+        with open(os.path.join(fname, _manifest_fname), 'w') as handle:
+            json.dump(manifest, handle, default = _to_json)
+    else:
+        raise ValueError(f'format must be one of "columnar" or "pickle", got {format}')
 
-def load(fname):
-    #read in the raw data
-    with open(fname, 'rb') as handle:
-        data = pickle.load(handle)
-    return data
\ No newline at end of file
+def load(fname, channels = None, mmap = True):
+    '''
+    load data saved with save
+
+    channels -- list of channels to load (columnar format only). for rawEyes, a channel name also matches its eye specific
+                versions (e.g. 'pupil_clean' matches 'pupil_clean_l' and 'pupil_clean_r'). trackertime and time are always loaded.
+                if None, all channels are loaded
+    mmap     -- if True, channels are memory-mapped (copy-on-write) rather than read into memory (columnar format only).
+                can also be a numpy mmap_mode: 'r+' writes changes (e.g. epochedEyes.apply_baseline) back to the file, so data bigger
+                than memory can be changed in place, and 'r' is read-only. changing copy-on-write data would copy each page changed into
+                memory, so epochedEyes.apply_baseline writes copy-on-write (and read-only) data to a new array instead
+    '''
+    if not os.path.isdir(fname):
+        #read in the raw data
+        with open(fname, 'rb') as handle:
+            data = pickle.load(handle)
+        return data
+    
+    with open(os.path.join(fname, _manifest_fname), 'r') as handle:
+        manifest = json.load(handle)
+    if isinstance(mmap, str):
+        mmap_mode = mmap
+    else:
+        mmap_mode = 'c' if mmap else None #copy-on-write, so changes to the data are never written back to the file
+    if manifest['type'] == 'rawEyes':
+        data = _load_raw(manifest, fname, channels, mmap_mode)
+    elif manifest['type'] == 'epochedEyes':
+        data = _load_epochs(manifest, fname, channels, mmap_mode)
+    return data
+
+_manifest_fname = 'manifest.json'
+
+def _save_raw(obj, fname):
+    manifest = dict(type = 'rawEyes', version = 2, attrs = dict(), blocks = [])
+    for attr, value in obj.__dict__.items():
+        if attr != 'data':
+            manifest['attrs'][attr] = value
+    
+    for iblock in range(obj.nblocks):
+        blockdata = obj.data[iblock]
+        blockdir  = f'block{iblock}'
+        os.makedirs(os.path.join(fname, blockdir), exist_ok = True)
+        block = dict(dir = blockdir, store = [], arrays = [], triggers = dict(), blinks = dict(), events = dict(), attrs = dict())
+        if blockdata.channels is not None:
+            #the channels are saved together as the rows of one [nchannels x nsamples] array, that can be memory-mapped as the channel store on loading
+            block['store'] = blockdata.channels.names
+            np.save(os.path.join(fname, blockdir, 'channels.npy'), blockdata.channels.select(block['store']))
+        for attr in blockdata.keys():
+            if attr in block['store']:
+                continue
+            value = getattr(blockdata, attr)
+            if isinstance(value, np.ndarray):
+                np.save(os.path.join(fname, blockdir, f'{attr}.npy'), value)
+                block['arrays'].append(attr)
+            elif isinstance(value, EyeTriggers):
+                block['triggers'] = dict(timestamp = value.timestamp, event_id = value.event_id, message = value.message)
+            elif isinstance(value, Blinks):
+                block['blinks'][attr] = dict(blinkstart = value.blinkstart, blinkend = value.blinkend, blinkdur = value.blinkdur)
+            elif isinstance(value, EventTable):
+                block['events'][attr] = dict(type = type(value).__name__, events = value.to_array())
+            else:
+                block['attrs'][attr] = value
+        manifest['blocks'].append(block)
+    return manifest
+
+def _load_raw(manifest, fname, channels, mmap_mode):
+    attrs = manifest['attrs']
+    data = rawEyes(nblocks = attrs['nblocks'], srate = attrs['srate'])
+    for attr, value in attrs.items():
+        setattr(data, attr, value)
+    
+    for block in manifest['blocks']:
+        blockdata = EyeHolder()
+        for attr, value in block['attrs'].items():
+            setattr(blockdata, attr, value)
+        for attr in block.get('arrays', block.get('channels', [])): #(version 1 saved every channel to its own file)
+            if channels is None or attr in ['trackertime', 'time'] or _channel_selected(attr, channels):
+                setattr(blockdata, attr, np.load(os.path.join(fname, block['dir'], f'{attr}.npy'), mmap_mode = mmap_mode))
+        if len(block.get('store', [])) > 0:
+            store = ChannelStore.from_array(np.load(os.path.join(fname, block['dir'], 'channels.npy'), mmap_mode = mmap_mode), block['store'])
+            for channel in block['store']:
+                if channels is not None and not _channel_selected(channel, channels):
+                    store.drop(channel) #its row is never read from disk
+            blockdata.channels = store
+        if len(block['triggers']) > 0:
+            blockdata.triggers = EyeTriggers(timestamp = block['triggers']['timestamp'], event_id = block['triggers']['event_id'],
+                                             message = block['triggers'].get('message'))
+        for attr, blinks in block['blinks'].items():
+            setattr(blockdata, attr, Blinks(np.array([blinks['blinkstart'], blinks['blinkend'], blinks['blinkdur']]).T.reshape(-1, 3)))
+        for attr, events in block.get('events', dict()).items():
+            setattr(blockdata, attr, _event_tables[events['type']](np.array(events['events'])))
+        data.data.append(blockdata)
+    return data
+
+_event_tables = dict(Saccades = Saccades, Fixations = Fixations)
+
+def _channel_selected(channel, channels):
+    return channel in channels or (channel[-2:] in ['_l', '_r'] and channel[:-2] in channels)
+
+def _save_epochs(obj, fname):
+    #epochs are stored channel first ([nchannels x ntrials x ntimes]) so that each channel is contiguous on disk. they are written
+    #a chunk of trials at a time, so memory-mapped epochs aren't read into memory all at once, and lazy epochs stay lazy.
+    #the file is written under another name first, as the epochs may be memory-mapped from the file being replaced
+    tmpname = os.path.join(fname, 'data.npy.tmp')
+    data = np.lib.format.open_memmap(tmpname, mode = 'w+', dtype = obj.dtype, shape = (len(obj.channels), obj.ntrials, obj.times.size))
+    for chunk in obj._chunks():
+        data[:, chunk] = obj.get_data(chunk, copy = False).transpose(1, 0, 2)
+    data.flush()
+    del data
+    os.replace(tmpname, os.path.join(fname, 'data.npy'))
+    np.save(os.path.join(fname, 'times.npy'), obj.times)
+    manifest = dict(type = 'epochedEyes', version = 1, attrs = dict(), metadata = None)
+    for attr, value in obj.__dict__.items():
+        if attr == 'metadata':
+            if isinstance(value, pd.DataFrame):
+                manifest['metadata'] = value.to_json(orient = 'table')
+        elif attr not in ['_data', '_source', 'times']:
+            manifest['attrs'][attr] = value
+    return manifest
+
+def _load_epochs(manifest, fname, channels, mmap_mode):
+    attrs = manifest['attrs']
+    data  = np.load(os.path.join(fname, 'data.npy'), mmap_mode = mmap_mode)
+    if channels is not None:
+        chaninds = [attrs['channels'].index(x) for x in channels]
+        if np.array_equal(np.diff(chaninds), np.ones(len(chaninds)-1)):
+            data = data[chaninds[0]:chaninds[-1]+1] #consecutive channels can be taken as a view
+        else:
+            data = data[chaninds] #otherwise only the requested channels are read
+        attrs = dict(attrs, channels = list(channels))
+    
+    epoched = epochedEyes(data = data.transpose(1, 0, 2), srate = attrs['srate'], events = np.asarray(attrs['event_id'], dtype = str),
+                          times = np.load(os.path.join(fname, 'times.npy')), channels = attrs['channels'])
+    for attr, value in attrs.items():
+        if attr not in ['event_id', 'channels']:
+            setattr(epoched, attr, value)
+    if manifest['metadata'] is not None:
+        epoched.metadata = pd.read_json(StringIO(manifest['metadata']), orient = 'table')
+    return epoched
+
+def _to_json(value):
+    '''
+    convert numpy types for json.dump
+    '''
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'cannot save object of type {type(value)} in the manifest')
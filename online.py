@@ -0,0 +1,264 @@
+import numpy as np
+import scipy as sp
+import time
+from .io import _samples_to_array
+
+class OnlinePupil():
+    '''
+    clean pupil traces as the samples come in (e.g. for closed-loop experiments), rather than after the recording has finished.
+    this runs incremental versions of the offline steps nan_missingdata, identify_blinks, interpolate_blinks and smooth_pupil
+    (see raw.rawEyes), and only keeps a fixed number of past samples.
+
+    every sample comes out a fixed number of samples (latency) after it went in. this is the sum of:
+        - half of the blink buffer, as a sample is only known to be clean once it is clear of the buffer around any blink after it
+        - max_gap, the longest gap (in seconds) that gets interpolated. a sample in a gap that hasn't ended by the time it is due out
+          is set to the last clean value instead
+        - the radius of the smoothing kernel (truncate * sigma samples), or nothing if sigma is None
+    as long as gaps are shorter than max_gap the output matches the offline steps. to get a latency of buffer/2 + 10ms, for example,
+    use sigma = None and max_gap = 0.010
+
+    srate        - sampling rate of the data
+    buffer       - time (in seconds) padded around blinks, as in rawEyes.identify_blinks
+    sigma        - width (in samples) of the gaussian smoothing, as in rawEyes.smooth_pupil
+    '''
+    def __init__(self, srate = 1000, buffer = 0.150, sigma = 50, max_gap = 0.5, truncate = 4.0,
+                 maxvelthresh = 30, maxpupilsize = 20000):
+        self.srate          = srate
+        self.buffer         = buffer
+        self.sigma          = sigma
+        self.max_gap        = max_gap
+        self.maxvelthresh   = maxvelthresh
+        self.maxpupilsize   = maxpupilsize
+
+        cleanms = int(buffer * srate)
+        self.past, self.future = (cleanms//2, (cleanms-1)//2) if cleanms > 1 else (0, 0) #samples before/after a bad sample marked too (as utils.dilate)
+        self.gap = int(max_gap * srate)
+        if sigma is None:
+            self.radius, self.kernel = 0, None
+        else:
+            self.radius = int(truncate * sigma + 0.5) #same kernel as scipy.ndimage.gaussian_filter1d
+            x = np.arange(-self.radius, self.radius+1)
+            self.kernel = np.exp(-0.5 * (x/sigma)**2)
+            self.kernel /= self.kernel.sum()
+        self.latency = self.future + self.gap + self.radius #in samples
+        self.reset()
+
+    def reset(self):
+        '''
+        clear all state, ready for a new block of recording
+        '''
+        self.neyes = None #set by the first chunk of data
+        self.nsamples_in, self.nsamples_out = 0, 0
+
+    def _setup(self, neyes):
+        self.neyes = neyes
+        #blink detection: previous sample (for the pupil speed), then the marked samples and pending data for the buffer around them
+        self.prev  = np.full((neyes, 1), np.nan)
+        self.mhist = np.zeros((neyes, self.past), dtype = bool)
+        self.phist = np.zeros((neyes, 0))
+        self.thist = np.zeros(0)
+        #interpolation: the last clean sample that has gone out, then samples waiting to see if their gap ends
+        self.lastval  = np.full(neyes, np.nan)
+        self.lasttime = np.full(neyes, np.nan)
+        self.sbuf = np.zeros((neyes, 0))
+        self.tbuf = np.zeros(0)
+        #smoothing: samples still needed for the kernel
+        self.started = False
+        self.hist = np.zeros((neyes, 0))
+        self.htimes = np.zeros(0)
+
+    @property
+    def latency_ms(self):
+        return self.latency / self.srate * 1000
+
+    def process(self, trackertime, pupil):
+        '''
+        add a chunk of samples. pupil is [nsamples] for one eye or [neyes x nsamples].
+        returns (trackertime, pupil) for the samples that are ready, which lag the input by self.latency samples
+        '''
+        pupil = np.asarray(pupil, dtype = float)
+        self._squeeze = pupil.ndim == 1
+        pupil = np.atleast_2d(pupil)
+        if self.neyes is None:
+            self._setup(pupil.shape[0])
+        trackertime = np.asarray(trackertime, dtype = float)
+        self.nsamples_in += trackertime.size
+
+        t, signal = self._find_blinks(trackertime, pupil)
+        t, clean  = self._interpolate(t, signal)
+        t, smooth = self._smooth(t, clean)
+        return self._output(t, smooth)
+
+    def flush(self):
+        '''
+        push out the samples still held, at the end of a block of recording. the end of the data is handled the same way as offline
+        '''
+        if self.neyes is None:
+            return np.zeros(0), np.zeros(0)
+        t, signal = self._find_blinks(np.zeros(0), np.zeros((self.neyes, 0)), final = True)
+        t, clean  = self._interpolate(t, signal, final = True)
+        t, smooth = self._smooth(t, clean, final = True)
+        return self._output(t, smooth)
+
+    def run(self, source):
+        '''
+        process chunks of (trackertime, pupil) from an iterable (e.g. stream_asc, or a socket), yielding the cleaned samples as they are ready.
+        a None in source marks the end of a block, and flushes and resets the processor
+        '''
+        for chunk in source:
+            if chunk is None:
+                out = self.flush()
+                self.reset()
+            else:
+                out = self.process(*chunk)
+            if out[0].size > 0:
+                yield out
+        out = self.flush()
+        if out[0].size > 0:
+            yield out
+
+    def _output(self, t, pupil):
+        self.nsamples_out += t.size
+        return t, (pupil[0] if getattr(self, '_squeeze', False) else pupil)
+
+    def _find_blinks(self, t, pupil, final = False):
+        '''
+        nan_missingdata and _calculate_blink_periods, one chunk at a time
+        '''
+        pupil = np.where(pupil == 0, np.nan, pupil) #missing data is 0 in the pupil trace
+        if final: #nothing comes after the end, so the buffer only looks back
+            bad = np.zeros((self.neyes, self.future), dtype = bool)
+        else:
+            speed = np.abs(np.diff(np.hstack([self.prev, pupil]), axis = -1))
+            bad = np.logical_or(speed >= self.maxvelthresh, pupil > self.maxpupilsize)
+            if pupil.shape[1] > 0:
+                self.prev = pupil[:, -1:]
+        ext  = np.hstack([self.mhist, bad])
+        pext = np.hstack([self.phist, pupil])
+        text = np.concatenate([self.thist, t])
+        nout = max(ext.shape[1] - self.past - self.future, 0)
+        nout = min(nout, pext.shape[1]) #when flushing, only the pending samples go out
+        #a sample is bad if any sample in the window past..future around it is bad - counted with a cumulative sum, as utils.dilate
+        counts = np.zeros((self.neyes, ext.shape[1]+1), dtype = np.int64)
+        np.cumsum(ext, axis = -1, out = counts[:, 1:])
+        width = self.past + self.future + 1
+        marked = counts[:, width:width+nout] > counts[:, :nout]
+        signal = np.where(marked, np.nan, pext[:, :nout])
+
+        self.mhist, self.phist, self.thist = ext[:, nout:], pext[:, nout:], text[nout:]
+        return text[:nout], signal
+
+    def _interpolate(self, t, signal, final = False):
+        '''
+        linearly interpolate the nan samples, for gaps that end within self.gap samples
+        '''
+        ext  = np.hstack([self.sbuf, signal])
+        text = np.concatenate([self.tbuf, t])
+        nsamps = text.size
+        nout = nsamps if final else max(nsamps - self.gap, 0)
+
+        valid = ~np.isnan(ext)
+        inds  = np.arange(nsamps)
+        prev  = np.maximum.accumulate(np.where(valid, inds, -1), axis = -1) #last clean sample at or before each sample (-1 if none yet)
+        nxt   = np.minimum.accumulate(np.where(valid, inds, nsamps)[:, ::-1], axis = -1)[:, ::-1] #next clean sample after
+        prev, nxt = prev[:, :nout], nxt[:, :nout]
+
+        hasprev = np.logical_or(prev >= 0, ~np.isnan(self.lastval)[:, None])
+        hasnext = nxt < nsamps
+        if not final: #only use a clean sample that is within the latency
+            hasnext = np.logical_and(hasnext, nxt - inds[:nout] <= self.gap)
+        prevval  = np.where(prev >= 0, np.take_along_axis(ext, np.maximum(prev, 0), axis = -1), self.lastval[:, None])
+        prevtime = np.where(prev >= 0, text[np.maximum(prev, 0)], self.lasttime[:, None])
+        nextval  = np.take_along_axis(ext, np.minimum(nxt, nsamps-1), axis = -1) if nsamps > 0 else prevval
+        nexttime = text[np.minimum(nxt, nsamps-1)] if nsamps > 0 else prevtime
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            interp = prevval + (nextval - prevval) * (text[:nout] - prevtime) / (nexttime - prevtime)
+        filled = np.where(np.logical_and(hasprev, hasnext), interp, #inside a gap that has ended
+                          np.where(hasprev, prevval,               #gap still going (or the end of the data): hold the last clean value
+                                   np.where(hasnext, nextval, np.nan))) #before the first clean sample: use the next one
+        clean = np.where(valid[:, :nout], ext[:, :nout], filled)
+
+        if nout > 0: #keep the last clean sample that has gone out
+            lastprev = prev[:, -1]
+            seen = lastprev >= 0
+            self.lastval  = np.where(seen, ext[np.arange(self.neyes), np.maximum(lastprev, 0)], self.lastval)
+            self.lasttime = np.where(seen, text[np.maximum(lastprev, 0)], self.lasttime)
+        self.sbuf, self.tbuf = ext[:, nout:], text[nout:]
+        return text[:nout], clean
+
+    def _smooth(self, t, clean, final = False):
+        '''
+        gaussian smoothing (reflecting the data at the start and end, as scipy.ndimage.gaussian_filter1d)
+        '''
+        if self.kernel is None:
+            return t, clean
+        r = self.radius
+        self.hist   = np.hstack([self.hist, clean])
+        self.htimes = np.concatenate([self.htimes, t])
+        if not self.started:
+            if final: #all the data fits in the kernel, so just filter it
+                out = sp.ndimage.gaussian_filter1d(self.hist, sigma = self.sigma, axis = -1, radius = r) if self.htimes.size > 0 else self.hist
+                return self.htimes, out
+            if self.htimes.size <= r:
+                return np.zeros(0), np.zeros((self.neyes, 0))
+            self.hist = np.hstack([self.hist[:, :r][:, ::-1], self.hist]) #reflect the start of the data
+            self.started = True
+        if final:
+            self.hist = np.hstack([self.hist, self.hist[:, -r:][:, ::-1]]) #reflect the end of the data
+        nout = self.hist.shape[1] - 2*r
+        if nout <= 0:
+            return np.zeros(0), np.zeros((self.neyes, 0))
+        out = np.vstack([np.convolve(x, self.kernel, mode = 'valid') for x in self.hist])
+        times = self.htimes[:nout]
+        self.hist, self.htimes = self.hist[:, nout:], self.htimes[nout:]
+        return times, out
+
+def stream_asc(fname, follow = False, poll = 0.01, timeout = None, chunksize = 2**16):
+    '''
+    read the samples of an asc file in chunks of (trackertime, pupil), with pupil [neyes x nsamples], to pass to OnlinePupil.run.
+    None is given at the END of each block of recording.
+
+    follow  - if True, keep reading the file as it is written (like tail -f), checking for new lines every poll seconds.
+              stops after timeout seconds without new data (never, if timeout is None)
+    '''
+    ncols, pupilcols = None, None
+    partial = b''
+    lastdata = time.monotonic()
+    with open(fname, 'rb') as f:
+        while True:
+            lines = f.readlines(chunksize)
+            if len(lines) == 0:
+                if follow and (timeout is None or time.monotonic() - lastdata < timeout):
+                    time.sleep(poll)
+                    continue
+                if len(partial) == 0:
+                    break
+                lines, partial = [partial], b'' #last line of the file has no newline
+            else:
+                lastdata = time.monotonic()
+                lines[0] = partial + lines[0]
+                partial = b''
+                if follow and not lines[-1].endswith(b'\n'): #line is still being written
+                    partial = lines.pop()
+
+            samplelines = []
+            for line in lines:
+                if line[:1].isdigit():
+                    if ncols is not None:
+                        samplelines.append(line)
+                elif line.startswith(b'START'):
+                    binocular = b'LEFT' in line.split() and b'RIGHT' in line.split()
+                    ncols, pupilcols = [(4, [3]), (7, [3, 6])][int(binocular)]
+                elif line.startswith(b'END') and ncols is not None:
+                    if len(samplelines) > 0:
+                        yield _samples_to_chunk(samplelines, ncols, pupilcols)
+                        samplelines = []
+                    yield None
+                    ncols = None
+            if len(samplelines) > 0:
+                yield _samples_to_chunk(samplelines, ncols, pupilcols)
+
+def _samples_to_chunk(lines, ncols, pupilcols):
+    rows = _samples_to_array(lines, ncols)
+    return rows[:, 0], rows[:, pupilcols].T
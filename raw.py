@@ -1,8 +1,16 @@
 import numpy as np
-import scipy as sp
-from copy import deepcopy
-from .utils import smooth
-from .classes import Blinks
+from copy import copy, deepcopy
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from fractions import Fraction
+import warnings
+from .utils import dilate, polydetrend, resample, runs
+from .filters import gaussian
+from .classes import Blinks, Saccades, Fixations, EventTable, EyeHolder, ChannelStore, precisions
+from .stats import RunningStats, normalize
+from .instrument import timed
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class rawEyes():
@@ -13,269 +21,692 @@ class rawEyes():
         self.fsamp   = None
         self.binocular = None
     
-    def nan_missingdata(self):
-        for iblock in range(self.nblocks): #loop over blocks
-            tmpdata = self.data[iblock]
-            
-            if tmpdata.binocular: 
-                for ieye in tmpdata.eyes_recorded:
-                    missinds = np.where(getattr(tmpdata, 'pupil_'+ieye[0]) == 0)[0] #missing data is assigned to 0 for pupil trace
-                    #replace missing values with nan
-                    traces = [f'{x}_{ieye[0]}' for x in ['pupil', 'xpos', 'ypos']] #get attribute labels to loop over
-                    for trace in traces:
-                        getattr(tmpdata, trace)[missinds] = np.nan
-            else:
-                missinds = np.where(tmpdata.pupil == 0) #missing data is assigned to 0 for pupil trace
-                for trace in ['pupil', 'xpos', 'ypos']: #nan everything in these channels where the pupil is zero
-                    getattr(tmpdata, trace)[missinds] = np.nan
-                
-            self.data[iblock] = tmpdata
+    def copy(self, deep = False):
+        '''
+        copy the data structure. by default this is a shallow copy: each block is a new EyeHolder, but the channels are shared with the original
+        until a method replaces them (copy-on-write). use deep = True to copy all of the data
+        '''
+        if deep:
+            return deepcopy(self)
+        newdata = copy(self)
+        newdata.data = [self.data[iblock].copy() for iblock in range(self.nblocks)]
+        return newdata
+
+    def nan_missingdata(self, inplace = True):
+        '''
+        set samples where the pupil is missing (recorded as 0) to nan, in the pupil and gaze channels
+
+        inplace -- if True (default), the channels are modified in place. if False, a copy of the data structure is returned,
+                   and only the pupil and gaze channels are copied
+        '''
+        data = self if inplace else self.copy()
+        for iblock in range(data.nblocks): #loop over blocks
+            data.data[iblock] = _nan_missingdata(data.data[iblock], data.srate, copy = not inplace)
+        return data
     
-    def identify_blinks(self, buffer = 0.150, add_nanchannel = True):
-        #set up some parameters for the algorithm
-        blinkspd        = 2.5                     #speed above which data is remove around nan periods -- threshold
-        maxvelthresh    = 30
-        maxpupilsize    = 20000
-        cleanms         = buffer * self.srate     #ms padding around the blink edges for removal
-        
-        for iblock in range(self.nblocks): #loop over blocks in the data
-            blockdata = deepcopy(self.data[iblock])
-            binocular = blockdata.binocular
-            if binocular:
-                blockdata = _find_blinks_binocular(blockdata, self.srate, buffer, add_nanchannel, blinkspd, maxvelthresh, maxpupilsize, cleanms)
-            elif not binocular:
-                blockdata = _find_blinks_monocular(blockdata, self.srate, buffer, add_nanchannel, blinkspd, maxvelthresh, maxpupilsize, cleanms)
-            
-            self.data[iblock] = blockdata #assign back into the data structure
-            self.data[iblock].info['blinks_identified'] = True #log that this step has happened
+    def identify_blinks(self, buffer = 0.150, add_nanchannel = None, method = 'velocity', inplace = True):
+        '''
+        identify blinks (and other bad periods) in the pupil trace of each eye
+
+        buffer         -- time (in seconds) padded around blinks (a window of buffer centred on each bad sample)
+        add_nanchannel -- if True, store the samples to interpolate as a nan copy of the pupil trace (pupil_nan), if False as a boolean
+                          mask (blinkmask). defaults to the precision the data were parsed with (see io.parse_eyes)
+        method         -- 'velocity' (default) finds blinks from the speed of the pupil trace. 'tracker' uses the blinks the eyetracker
+                          reported (the tracker_blinks events kept by io.parse_eyes), which is much faster. blocks without tracker
+                          events (e.g. files exported without them) fall back to 'velocity'
+        inplace        -- if True (default) the blinks and nan channels are added to this object, otherwise to a (shallow) copy of it
+        '''
+        data = self if inplace else self.copy()
+        for iblock in range(data.nblocks): #loop over blocks in the data
+            data.data[iblock] = _identify_blinks(data.data[iblock], data.srate, buffer = buffer, add_nanchannel = add_nanchannel, method = method)
+        return data
     
-    def interpolate_blinks(self):
-        for iblock in range(self.nblocks):
-            if self.data[iblock].binocular:
-                self.data[iblock] = _interpolate_blinks_binocular(self.data[iblock])
-            else:
-                nsamps = self.data[iblock].trackertime.size
-                if np.isnan(self.data[iblock].pupil).sum() == nsamps: #data missing for entire block
-                    self.data[iblock].info['full_block_missing'] = True
-                    setattr(self.data[iblock], 'pupil_clean', np.zeros(nsamps)*np.nan)
-                else:
-                    self.data[iblock].info['full_block_missing'] = False
-                    self.data[iblock] = _interpolate_blinks_monocular(self.data[iblock])
-            self.data[iblock].info['blinks_cleaned'] = True #log that this step has happened
-
-    def drop_eye(self, eye_to_drop):
+    def interpolate_blinks(self, inplace = True):
+        '''
+        interpolate over the nan periods identified by identify_blinks, creating the pupil_clean channel(s)
+
+        inplace -- if True (default) the clean channels are added to this object, otherwise to a (shallow) copy of it
+        '''
+        data = self if inplace else self.copy()
+        for iblock in range(data.nblocks):
+            data.data[iblock] = _interpolate_blinks(data.data[iblock], data.srate)
+        return data
+
+    def identify_saccades(self, vfac = 6, mindur = 0.006, minfixdur = 0.05, agreement = True, inplace = True):
+        '''
+        identify saccades and fixations in the gaze (xpos/ypos) of each eye, with an adaptive velocity threshold (engbert & kliegl, 2003).
+        run nan_missingdata first, so missing samples aren't taken as eye movements. this creates saccades and fixations (saccades_l, ...)
+        event tables (classes.Saccades, classes.Fixations), with sample indices like blinks
+
+        vfac      -- threshold, as a multiple of a median-based estimate of the standard deviation of the velocity of each eye in each direction
+        mindur    -- minimum duration of a saccade (seconds)
+        minfixdur -- minimum duration of a fixation (seconds)
+        agreement -- if True (default), in binocular data only saccades that overlap in time with a saccade of the other eye are kept
+                     (unless the other eye has missing data then)
+        inplace   -- if True (default) the saccades and fixations are added to this object, otherwise to a (shallow) copy of it
+        '''
+        data = self if inplace else self.copy()
+        for iblock in range(data.nblocks):
+            data.data[iblock] = _identify_saccades(data.data[iblock], data.srate, vfac = vfac, mindur = mindur, minfixdur = minfixdur,
+                                                   agreement = agreement)
+        return data
+
+    def drop_eye(self, eye_to_drop, inplace = True):
         '''
         this function drops one eye from the data structure, and amends the structure accordingly. From this point on, code will perceive it to be monocular and look for appropriate attributes
+
+        inplace -- if True (default) the eye is dropped from this object, otherwise from a (shallow) copy of it. channels are never copied
         '''
-        eye = eye_to_drop.lower() #force lower case to identify the right attributes
-        not_dropped = ['right' if eye == 'left' else 'left'][0]
-        nblocks = self.nblocks
-        for iblock in range(nblocks):
-            tmpdata = deepcopy(self.data[iblock])
-            if tmpdata.binocular == False:
-                print(f'skipping block {iblock+1} as data are already monocular')
-            elif tmpdata.binocular:
-                attrs_to_del = [x for x in tmpdata.__dict__.keys() if f'_{eye[0]}' in x]
-                for iattr in attrs_to_del:
-                    delattr(tmpdata, iattr)
-            attrs_to_rename = [x for x in tmpdata.__dict__.keys() if x[-2:] == f'_{not_dropped[0]}']
-            for attr in attrs_to_rename:
-                #rename attribute by creating a new one with the same values, then deleting the old one
-                setattr(tmpdata, attr[:-2], getattr(tmpdata, attr))
-                delattr(tmpdata, attr)
-                
-            setattr(tmpdata, 'binocular', False)
-            setattr(tmpdata, 'eyes_recorded', [not_dropped])
-            self.data[iblock] = tmpdata
+        data = self if inplace else self.copy()
+        for iblock in range(data.nblocks):
+            data.data[iblock] = _drop_eye(data.data[iblock], data.srate, eye_to_drop = eye_to_drop)
+        return data
             
-    def smooth_pupil(self, sigma = 50):
+    def smooth_pupil(self, sigma = 50, inplace = True):
         '''
         smooth the clean pupil trace with a gaussian with standard deviation sigma
+
+        inplace -- if True (default) the smoothed trace replaces pupil_clean in this object, otherwise in a (shallow) copy of it
+        '''
+        data = self if inplace else self.copy()
+        for iblock in range(data.nblocks):
+            data.data[iblock] = _smooth_pupil(data.data[iblock], data.srate, sigma = sigma)
+        return data
+
+    def cubicfit(self, order = 3, inplace = True):
+        '''
+        fit a cubic (or a polynomial of another order) to the clean pupil trace of each block, and remove it (creating the modelled and pupil_corrected channels)
+
+        order   -- order of the polynomial to fit. defaults to 3 (cubic)
+        inplace -- if True (default) the new channels are added to this object, otherwise to a (shallow) copy of it
         '''
+        data = self if inplace else self.copy()
+        for iblock in range(data.nblocks):
+            data.data[iblock] = _cubicfit(data.data[iblock], data.srate, order = order)
+        return data
+
+    def transform_channel(self, channel, method = 'percent', scope = 'block', stats = None, output = 'pupil_transformed', inplace = True):
+        '''
+        transform a channel (zscore or percent change from the mean), ignoring nans
+
+        scope   -- 'block' (default) normalizes each block by its own mean (and standard deviation), 'session' by those of all blocks
+        stats   -- statistics (stats.RunningStats) to normalize by instead, e.g. of all sessions of a participant (see channel_stats)
+        output  -- name of the channel to write to. if this is channel it is normalized in place, and an output that already exists is
+                   overwritten in place (unless its row is shared, e.g. with a copy of the data), so no temporary copy of the channel is made
+        inplace -- if True (default) the new channel is added to this object, otherwise to a (shallow) copy of it
+        '''
+        if scope not in ['block', 'session']:
+            raise ValueError(f"scope must be one of 'block' or 'session', got {scope}")
+        data = self if inplace else self.copy()
+        if stats is None and scope == 'session':
+            stats = data.channel_stats(channel)
+        for iblock in range(data.nblocks): #loop over blocks in the data
+            data.data[iblock] = _transform_channel(data.data[iblock], data.srate, channel = channel, method = method, stats = stats, output = output)
+        return data
+
+    def channel_stats(self, channel, stats = None):
+        '''
+        running statistics (stats.RunningStats) of a channel across all blocks, in one pass. pass in stats to add to them,
+        or add up the statistics of several sessions (e.g. sum([x.channel_stats('pupil_clean') for x in sessions]))
+        '''
+        stats = RunningStats() if stats is None else stats
         for iblock in range(self.nblocks):
-            blockdata = deepcopy(self.data[iblock])
-            if blockdata.binocular:
-                for eye in blockdata.eyes_recorded:
-                    ieye = eye[0]
-                    att = f'pupil_clean_{ieye}'
-                    if not hasattr(blockdata, att):
-                        raise AttributeError(f'Attribute not found: could not find {att}')
-                    else:
-                        setattr(blockdata, f'pupil_clean_{ieye}',
-                                sp.ndimage.gaussian_filter1d(getattr(blockdata, f'pupil_clean_{ieye}'), sigma=sigma) #smooth signal
-                                )
-            elif not blockdata.binocular:
-                if not hasattr(blockdata, 'pupil_clean'):
-                    raise AttributeError('Attribute not found: could not find "pupil_clean"')
-                else:
-                    if not blockdata.info['full_block_missing']: #dont do anything if the full block is missing
-                        setattr(blockdata, 'pupil_clean',
-                                sp.ndimage.gaussian_filter1d(getattr(blockdata, 'pupil_clean'), sigma=sigma) #smooth signal
-                        )
-            self.data[iblock] = blockdata
-
-    def cubicfit(self):
-        #define cubic function to be fit to the data
-        def cubfit(x, a, b, c, d):
-            return a*np.power(x,3) + b*np.power(x, 2) + c*np.power(x,1) + d
+            stats.update(getattr(self.data[iblock], channel))
+        return stats
+
+    def resample(self, new_srate, inplace = True):
+        '''
+        resample the data of every block to a new sampling rate (e.g. to run later steps on less data), with polyphase filtering so
+        there is no aliasing (see utils.resample). all channels of a block are resampled together.
+        trackertime, time and srate, and the sample indices of triggers and blinks, are updated to match.
+        run this after nan_missingdata, so missing data (0 in the pupil trace) isn't smoothed into the samples around it
+
+        inplace -- if True (default) this object is resampled, otherwise a (shallow) copy of it is
+        '''
+        data = self if inplace else self.copy()
+        ratio = Fraction(new_srate).limit_denominator(10000) / Fraction(data.srate).limit_denominator(10000)
+        for iblock in range(data.nblocks):
+            data.data[iblock] = _resample(data.data[iblock], data.srate, up = ratio.numerator, down = ratio.denominator)
+        data.srate = new_srate
+        return data
+
+    def preprocess(self, steps, n_jobs = 1, backend = 'threads', inplace = True):
+        '''
+        run a chain of preprocessing steps on each block in turn, while its data is still in memory/cache,
+        rather than running each step across all blocks before moving on to the next one.
+        blocks are independent, so can be processed in parallel. each job runs all the steps on one whole block (the eyes of a
+        binocular block share the block's channel store, so they are never processed in separate jobs).
+        the result is identical to calling the steps one by one, whatever n_jobs is
+
+        steps   -- list of steps to run, in order. each step is either the name of a rawEyes method, or a (name, dict of arguments) pair, e.g.
+                   ['nan_missingdata', ('identify_blinks', dict(buffer = 0.1)), 'interpolate_blinks', ('smooth_pupil', dict(sigma = 50)), 'cubicfit']
+                   available steps are: nan_missingdata, identify_blinks, identify_saccades, interpolate_blinks, smooth_pupil, cubicfit, transform_channel, drop_eye
+        n_jobs  -- number of blocks to process at the same time
+        backend -- 'threads' (default; numpy releases the GIL for most of the work) or 'processes'
+        inplace -- if True (default) this object is modified, otherwise a (shallow) copy of it
+
+        transform_channel takes the same scope as rawEyes.transform_channel. with scope = 'session' (and no stats) the statistics of
+        all blocks are needed, so the steps before it are first run on every block, then the statistics are worked out across blocks
+        (channel_stats) and the rest of the steps are run block by block as usual
+        '''
+        steps = [(x, dict()) if isinstance(x, str) else (x[0], dict(x[1])) for x in steps]
+        segments = [[]] #runs of steps that can be done block by block, split at steps that need all blocks first
+        for name, kwargs in steps:
+            if name not in _steps:
+                raise ValueError(f'unknown preprocessing step {name}, must be one of {list(_steps.keys())}')
+            if name == 'nan_missingdata':
+                kwargs.setdefault('copy', not inplace)
+            if name == 'transform_channel':
+                scope = kwargs.pop('scope', 'block')
+                if scope not in ['block', 'session']:
+                    raise ValueError(f"scope must be one of 'block' or 'session', got {scope}")
+                if scope == 'session' and kwargs.get('stats') is None:
+                    segments.append([])
+            segments[-1].append((name, kwargs))
+        data = self if inplace else self.copy()
         
-        for iblock in range(self.nblocks):
-            tmpdata = self.data[iblock]
-            if not tmpdata.binocular and not tmpdata.info['full_block_missing']: #cant model when full block recorded is bad
-                fitparams = sp.optimize.curve_fit(cubfit, tmpdata.time, tmpdata.pupil_clean)[0]
-                modelled  = fitparams[0]*np.power(tmpdata.time, 3) + fitparams[1]*np.power(tmpdata.time, 2) + fitparams[2]*np.power(tmpdata.time, 1) + fitparams[3]
-                diff = tmpdata.pupil_clean - modelled #subtract this cubic fit
-                #assign modelled data and the corrected data back into the data structure
-                
-                self.data[iblock].modelled        = modelled
-                self.data[iblock].pupil_corrected = diff
-            elif tmpdata.binocular:
-                for eye in tmpdata.eyes_recorded:
-                    ieye = eye[0] #get suffix used to get the right data
-                    ip = getattr(tmpdata, f'pupil_clean_{ieye}').copy()
-                    fitparams = sp.optimize.curve_fit(cubfit, tmpdata.time, ip)[0]
-                    modelled  = fitparams[0]*np.power(tmpdata.time, 3) + fitparams[1]*np.power(tmpdata.time, 2) + fitparams[2]*np.power(tmpdata.time, 1) + fitparams[3]
-                    diff = ip - modelled #subtract this cubic fit
-                    setattr(self.data[iblock], f'pupil_corrected_{ieye}', diff)
-                    setattr(self.data[iblock], f'modelled_{ieye}', modelled)
-            self.data[iblock].info['pupil_corrected'] = True #log that this step has happened
-
-    def transform_channel(self, channel, method = 'percent'):
-        for iblock in range(self.nblocks): #loop over blocks in the data
-            tmpdata = self.data[iblock].__getattribute__(channel).copy()
-            transformed = np.zeros_like(tmpdata)
-            if method == 'zscore':
-                transformed = sp.stats.zscore(tmpdata)
-            elif method == 'percent':
-                mean = tmpdata.mean()
-                transformed = np.subtract(tmpdata, mean)
-                transformed = np.multiply(np.divide(transformed, mean), 100)
-            self.data[iblock].__setattr__('pupil_transformed', transformed) #save the transformed data back into the data object
-            #self.data[iblock].pupil_transformed = transformed 
-            self.data[iblock].info['pupil_transformed'] = True #log that this step has happened
-
-
-def _find_blinks_binocular(data, srate, buffer, add_nanchannel, blinkspd, maxvelthresh, maxpupilsize, cleanms):
+        for isegment, segment in enumerate(segments):
+            if isegment > 0: #starts with a session-wide transform_channel, so get the statistics of the channel across blocks now
+                segment[0][1]['stats'] = data.channel_stats(segment[0][1]['channel'])
+            if n_jobs == 1:
+                for iblock in range(data.nblocks):
+                    data.data[iblock] = _run_steps(data.data[iblock], data.srate, segment)
+            else:
+                executor = dict(threads = ThreadPoolExecutor, processes = ProcessPoolExecutor)[backend]
+                with executor(max_workers = n_jobs) as pool:
+                    futures = [pool.submit(_run_steps, data.data[iblock], data.srate, segment) for iblock in range(data.nblocks)]
+                    for iblock, future in enumerate(futures):
+                        data.data[iblock] = future.result()
+        return data
+
+
+def _run_steps(data, srate, steps):
+    '''
+    run a list of (step name, arguments) on a single block of recorded data (class: EyeHolder)
+    '''
+    for name, kwargs in steps:
+        data = _steps[name](data, srate, **kwargs)
+    return data
+
+def _eye_suffixes(data, eyes = None):
+    '''
+    get the suffixes of the channels for the eyes to process in a block. monocular data have no suffix
+    '''
+    if not data.binocular:
+        return ['']
+    eyes = data.eyes_recorded if eyes is None else eyes
+    return [f'_{eye[0]}' for eye in eyes]
+
+def _reserve_channels(data, names):
+    '''
+    make room in a block's channel store for the channels a step is about to add, before it makes its temporary arrays (see ChannelStore.reserve)
+    '''
+    if data.channels is not None:
+        data.channels.reserve(names)
+
+@timed('nan_missingdata')
+def _nan_missingdata(data, srate = None, eyes = None, copy = False):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    copy - if True, the channels that are changed are replaced with new arrays rather than modified in place
+    '''
+    for suffix in _eye_suffixes(data, eyes):
+        missing = getattr(data, 'pupil'+suffix) == 0 #missing data is assigned to 0 for pupil trace
+        #replace missing values with nan, in the pupil and gaze channels
+        for trace in [f'{x}{suffix}' for x in ['pupil', 'xpos', 'ypos']]:
+            if copy:
+                setattr(data, trace, np.where(missing, np.nan, getattr(data, trace)))
+            else: #through the store, so channels shared with a copy of the data are copied before they are changed
+                data.channels.row(trace)[missing] = np.nan
+    return data
+
+def _count_blinks(data):
+    '''
+    number of blinks found in each eye of a block, for the instrumentation record
+    '''
+    return dict(nblinks = {attr: data.attrs[attr].nblinks for attr in data.attrs if isinstance(data.attrs[attr], Blinks)})
+
+@timed('identify_blinks', summary = _count_blinks)
+def _identify_blinks(data, srate, eyes = None, buffer = 0.150, add_nanchannel = None, method = 'velocity'):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    add_nanchannel - if True, the samples to interpolate are stored as a nan copy of the pupil trace (pupil_nan), otherwise as a boolean
+                     mask (blinkmask). defaults to the precision policy the data were parsed with (see classes.precisions)
+    '''
+    if method not in ['velocity', 'tracker']:
+        raise ValueError(f"method must be one of 'velocity' or 'tracker', got {method}")
+    if add_nanchannel is None:
+        add_nanchannel = precisions[data.info.get('precision', 'double')]['nanchannels']
+    #set up some parameters for the algorithm
+    blinkspd        = 2.5                     #speed above which data is remove around nan periods -- threshold
+    maxvelthresh    = 30
+    maxpupilsize    = 20000
+    cleanms         = buffer * srate          #ms padding around the blink edges for removal
+    if add_nanchannel:
+        _reserve_channels(data, [f'pupil_nan{suffix}' for suffix in _eye_suffixes(data, eyes)])
+    
+    if method == 'tracker' and all(hasattr(data, f'tracker_blinks{suffix}') for suffix in _eye_suffixes(data, eyes)):
+        data = _find_blinks_tracker(data, srate, add_nanchannel, cleanms, eyes = eyes)
+    else:
+        if method == 'tracker':
+            logger.info('no blink events from the tracker in this block, finding blinks from the pupil trace instead')
+        if data.binocular:
+            data = _find_blinks_binocular(data, srate, buffer, add_nanchannel, blinkspd, maxvelthresh, maxpupilsize, cleanms, eyes = eyes)
+        elif not data.binocular:
+            data = _find_blinks_monocular(data, srate, buffer, add_nanchannel, blinkspd, maxvelthresh, maxpupilsize, cleanms)
+    data.info['blinks_identified'] = True #log that this step has happened
+    return data
+
+threshold_samples = 2**18 #most samples (per eye) that the saccade velocity threshold is estimated from
+
+def _count_saccades(data):
+    '''
+    number of saccades found in each eye of a block, for the instrumentation record
+    '''
+    return dict(nsaccades = {attr: len(data.attrs[attr]) for attr in data.attrs if isinstance(data.attrs[attr], Saccades)})
+
+@timed('identify_saccades', summary = _count_saccades)
+def _identify_saccades(data, srate, eyes = None, vfac = 6, mindur = 0.006, minfixdur = 0.05, agreement = True):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    '''
+    suffixes = _eye_suffixes(data, eyes)
+    nsamps = data.trackertime.size
+    padded = np.empty(shape = (len(suffixes), 2, nsamps+4)) #[neyes x 2 (x, y) x nsamples], so all eyes are processed at once
+    gaze = padded[..., 2:-2] #with the first and last samples repeated twice either side, for the velocity at the ends
+    for ieye, suffix in enumerate(suffixes):
+        gaze[ieye, 0], gaze[ieye, 1] = getattr(data, f'xpos{suffix}'), getattr(data, f'ypos{suffix}')
+    padded[..., :2], padded[..., -2:] = gaze[..., :1], gaze[..., -1:]
+    velocity = _gaze_velocity(padded, srate)
+
+    #the threshold for each eye and direction is vfac times a median-based estimate of the standard deviation of the velocity
+    #(engbert & kliegl, 2003). for very long blocks this is estimated from evenly spaced samples (see threshold_samples)
+    sample = velocity[..., ::max(-(-nsamps // threshold_samples), 1)]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) #eyes with no data get a nan threshold, so no saccades
+        sd = np.sqrt(np.nanmedian(np.square(sample), axis = -1) - np.nanmedian(sample, axis = -1)**2)
+    sqvel  = np.square(velocity, out = velocity)
+    speed2 = sqvel[:, 0] + sqvel[:, 1] #squared speed, [neyes x nsamples]
+    missing = np.isnan(speed2)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        sqvel *= 1 / np.square(vfac * sd[..., np.newaxis]) #squared velocity relative to the threshold, in place as it isn't needed after this
+        fast = np.add(sqvel[:, 0], sqvel[:, 1], out = sqvel[:, 0]) > 1 #outside the elliptic threshold
+
+    eye, starts, ends = runs(fast)
+    #drop saccades that are too short, or that run into missing data (the edges of blinks)
+    before = (starts > 0) & missing[eye, np.maximum(starts-1, 0)]
+    after  = (ends < nsamps) & missing[eye, np.minimum(ends, nsamps-1)]
+    keep = (ends - starts >= mindur * srate) & ~before & ~after
+    eye, starts, ends = eye[keep], starts[keep], ends[keep]
+    if agreement and len(suffixes) == 2:
+        keep = _binocular_agreement(eye, starts, ends, missing)
+        eye, starts, ends = eye[keep], starts[keep], ends[keep]
+    peakvel = np.sqrt(_run_reduce(np.maximum, speed2, eye, starts, ends))
+    startpos, endpos = gaze[eye, :, starts], gaze[eye, :, ends-1] #[nsaccades x 2]
+    saccades = np.column_stack([starts, ends, (ends - starts) / srate, np.hypot(*(endpos - startpos).T), peakvel, startpos, endpos])
+
+    #fixations are the runs of samples with gaze data that aren't in a saccade
+    fixating = ~(_run_mask(eye, starts, ends, missing.shape) | missing)
+    fixeye, fixstarts, fixends = runs(fixating)
+    keep = fixends - fixstarts >= minfixdur * srate
+    fixeye, fixstarts, fixends = fixeye[keep], fixstarts[keep], fixends[keep]
+    rows = gaze.reshape(-1, nsamps) #x and y of each eye in turn
+    meanpos = [_run_reduce(np.add, rows, 2*fixeye + idim, fixstarts, fixends) / (fixends - fixstarts) for idim in range(2)]
+    fixations = np.column_stack([fixstarts, fixends, (fixends - fixstarts) / srate] + meanpos)
+
+    for ieye, suffix in enumerate(suffixes):
+        setattr(data, f'saccades{suffix}', Saccades(saccades[eye == ieye]))
+        setattr(data, f'fixations{suffix}', Fixations(fixations[fixeye == ieye]))
+    data.info['saccades_identified'] = True #log that this step has happened
+    return data
+
+@timed('interpolate_blinks')
+def _interpolate_blinks(data, srate = None, eyes = None):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    '''
+    _reserve_channels(data, [f'pupil_clean{suffix}' for suffix in _eye_suffixes(data, eyes)])
+    if data.binocular:
+        data = _interpolate_blinks_binocular(data, eyes = eyes)
+    else:
+        nsamps = data.trackertime.size
+        if np.isnan(data.pupil).sum() == nsamps: #data missing for entire block
+            data.info['full_block_missing'] = True
+            setattr(data, 'pupil_clean', np.zeros(nsamps)*np.nan)
+        else:
+            data.info['full_block_missing'] = False
+            data = _interpolate_blinks_monocular(data)
+    data.info['blinks_cleaned'] = True #log that this step has happened
+    return data
+
+@timed('drop_eye')
+def _drop_eye(data, srate = None, eyes = None, eye_to_drop = None):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    '''
+    if data.binocular == False:
+        logger.info('skipping block as data are already monocular')
+    data._drop_eye(eye_to_drop) #channels are renamed/dropped in the channel index, without copying any data
+    return data
+
+@timed('smooth_pupil')
+def _smooth_pupil(data, srate = None, eyes = None, sigma = 50):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    '''
+    if data.binocular:
+        names = [f'pupil_clean{suffix}' for suffix in _eye_suffixes(data, eyes)]
+    elif not data.info['full_block_missing']: #dont do anything if the full block is missing
+        names = ['pupil_clean']
+    else:
+        names = []
+    for name in names:
+        if not hasattr(data, name):
+            raise AttributeError(f'Attribute not found: could not find {name}')
+    _reserve_channels(data, names)
+    for name in names:
+        smoothed = data.channels.row(name) #the channel's own row (copied first if it is shared), smoothed in place a chunk at a time
+        gaussian(smoothed, sigma = sigma, out = smoothed)
+    return data
+
+@timed('cubicfit')
+def _cubicfit(data, srate = None, eyes = None, order = 3):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    '''
+    if data.binocular:
+        suffixes = _eye_suffixes(data, eyes)
+    elif not data.info['full_block_missing']: #cant model when full block recorded is bad
+        suffixes = ['']
+    else:
+        suffixes = []
+    _reserve_channels(data, [f'{name}{suffix}' for suffix in suffixes for name in ['modelled', 'pupil_corrected']])
+    for suffix in suffixes:
+        #fit and subtract the polynomial, writing the modelled and the corrected data straight into their channels
+        polydetrend(data.time, getattr(data, f'pupil_clean{suffix}'), order = order,
+                    out = (data.channels.row(f'modelled{suffix}'), data.channels.row(f'pupil_corrected{suffix}')))
+    data.info['pupil_corrected'] = True #log that this step has happened
+    return data
+
+@timed('transform_channel')
+def _transform_channel(data, srate = None, eyes = None, channel = None, method = 'percent', stats = None, output = 'pupil_transformed'):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    stats - statistics to normalize by (stats.RunningStats). if None, the block's own are used
+    '''
+    values = getattr(data, channel)
+    if stats is None:
+        stats = RunningStats.from_array(values)
+    if data.channels is not None and channel in data.channels: #write straight into the output's row (in place if it is channel, or already exists)
+        normalize(values, stats, method = method, out = data.channels.row(output))
+    else:
+        setattr(data, output, normalize(values, stats, method = method))
+    data.info[output] = True #log that this step has happened
+    return data
+
+#preprocessing steps that can be run by rawEyes.preprocess, and the function applied to each block
+_steps = dict(
+    nan_missingdata    = _nan_missingdata,
+    identify_blinks    = _identify_blinks,
+    identify_saccades  = _identify_saccades,
+    interpolate_blinks = _interpolate_blinks,
+    smooth_pupil       = _smooth_pupil,
+    cubicfit           = _cubicfit,
+    transform_channel  = _transform_channel,
+    drop_eye           = _drop_eye,
+)
+
+@timed('resample')
+def _resample(data, srate, eyes = None, up = 1, down = 1):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    '''
+    nsamps = data.trackertime.size
+    nout   = -(-nsamps * up // down) #same length as scipy.signal.resample_poly gives
+    if data.channels is not None and len(data.channels) > 0:
+        names = data.channels.names
+        data.channels = ChannelStore.from_array(resample(data.channels.select(names), up, down), names)
+    #tracker time is in ms
+    step = 1000 / srate * down / up
+    if np.issubdtype(data.trackertime.dtype, np.integer) and float(step).is_integer(): #keep tracker time as integers if it still can be
+        data.trackertime = data.trackertime[0] + np.arange(nout, dtype = np.int64) * int(step)
+    else:
+        data.trackertime = data.trackertime[0] + np.arange(nout) * step
+    data.time        = np.subtract(data.trackertime, data.trackertime[0])
+    data.triggers.get_samples(data.trackertime) #trigger sample indices for the new trackertime
+    nearest = np.minimum(np.round(np.arange(nout) * down / up).astype(int), nsamps-1)
+    for attr, value in list(data.attrs.items()):
+        if isinstance(value, Blinks): #blink start/end are sample indices
+            blinkarray = np.array([np.floor(value.blinkstart * up / down), np.minimum(np.ceil(value.blinkend * up / down), nout), value.blinkdur]).T
+            data.attrs[attr] = Blinks(blinkarray.reshape(-1, 3))
+        elif isinstance(value, EventTable): #so are the start/end of saccades and fixations
+            events = value.to_array()
+            events[:, 0] = np.floor(events[:, 0] * up / down)
+            events[:, 1] = np.minimum(np.ceil(events[:, 1] * up / down), nout)
+            data.attrs[attr] = type(value)(events)
+        #any other per-sample arrays take the nearest sample. tracker events are structured arrays in tracker time, so are left as they are
+        elif isinstance(value, np.ndarray) and value.dtype.names is None and value.ndim > 0 and value.shape[-1] == nsamps:
+            data.attrs[attr] = value[..., nearest]
+    return data
+
+def _find_blinks_binocular(data, srate, buffer, add_nanchannel, blinkspd, maxvelthresh, maxpupilsize, cleanms, eyes = None):
     '''
     data - a single block of recorded data (class: EyeHolder)
     '''
     idata = data
-    eyesrec = data.eyes_recorded
-    for eye in eyesrec:
-        ieye = eye[0] #the string for getting the data
-        pupil = getattr(data, 'pupil_'+ieye) #get the pupil trace for this eye
-        iblinks, nantrace = _calculate_blink_periods(pupil, srate, blinkspd, maxvelthresh, maxpupilsize, cleanms)
-        setattr(idata, 'blinks_'+ieye, iblinks)
-        if add_nanchannel:
-            setattr(idata, f'pupil_nan_{ieye}', nantrace) #assign nan channel for this eye
+    eyesrec = data.eyes_recorded if eyes is None else eyes
+    for eye in eyesrec: #one eye at a time, so the temporary arrays are the size of one trace rather than of both stacked
+        ieye_label = eye[0] #the string for getting the data
+        pupil = getattr(idata, 'pupil_'+ieye_label)
+        blinks, badsamps = _calculate_blink_periods(pupil, srate, blinkspd, maxvelthresh, maxpupilsize, cleanms)
+        setattr(idata, 'blinks_'+ieye_label, blinks)
+        _store_badsamples(idata, f'_{ieye_label}', pupil, badsamps, add_nanchannel)
     return idata
 
+def _find_blinks_tracker(data, srate, add_nanchannel, cleanms, eyes = None):
+    '''
+    data - a single block of recorded data (class: EyeHolder)
+    marks the blinks reported by the eyetracker (tracker_blinks), padded by the same window as utils.dilate pads bad samples
+    with in the velocity method, along with any missing samples
+    '''
+    nsamps = data.trackertime.size
+    width  = int(cleanms)
+    for suffix in _eye_suffixes(data, eyes):
+        pupil  = getattr(data, 'pupil'+suffix)
+        events = getattr(data, 'tracker_blinks'+suffix)
+        starts = np.searchsorted(data.trackertime, events['start'], side = 'left')
+        ends   = np.searchsorted(data.trackertime, events['end'], side = 'right') #the end of a blink is its last sample
+        if width > 1:
+            starts, ends = np.maximum(starts - (width-1)//2, 0), np.minimum(ends + width//2, nsamps)
+        badsamps = _run_mask(np.zeros(starts.size, dtype = np.int64), starts, ends, (1, nsamps))[0]
+        badsamps |= (pupil == 0) | np.isnan(pupil) #missing data that the tracker didn't call a blink
+        setattr(data, 'blinks'+suffix, _blinks_from_mask(badsamps, srate))
+        _store_badsamples(data, suffix, pupil, badsamps, add_nanchannel)
+    return data
+
 def _find_blinks_monocular(data, srate, buffer, add_nanchannel, blinkspd, maxvelthresh, maxpupilsize, cleanms):
     '''
     data - a single block of recorded data (class: EyeHolder)
     '''
-    idata = deepcopy(data)
+    idata = data
     pupil = data.pupil
-    iblinks, nantrace = _calculate_blink_periods(pupil, srate, blinkspd, maxvelthresh, maxpupilsize, cleanms)
+    iblinks, badsamps = _calculate_blink_periods(pupil, srate, blinkspd, maxvelthresh, maxpupilsize, cleanms)
     setattr(idata, 'blinks', iblinks)
-    if add_nanchannel:
-        setattr(idata, 'pupil_nan', nantrace) #assign nan channel for this eye
+    _store_badsamples(idata, '', pupil, badsamps, add_nanchannel)
     
     return idata
 
+def _store_badsamples(data, suffix, pupil, badsamps, add_nanchannel):
+    '''
+    store the samples of an eye to interpolate over, either as a nan copy of its pupil trace (written straight into the pupil_nan row of the
+    channel store, so no whole new trace is made first) or as a boolean mask (blinkmask)
+    '''
+    if not add_nanchannel:
+        setattr(data, 'blinkmask'+suffix, badsamps | np.isnan(pupil)) #or just which samples are missing (including those nan_missingdata set to nan)
+    else:
+        nantrace = data.channels.row('pupil_nan'+suffix) #assign nan channel for this eye
+        nantrace[:] = pupil
+        nantrace[badsamps] = np.nan
+
 def _interpolate_blinks_monocular(data):
     '''
     data - a single block of recorded data (class: EyeHolder)
     '''
-    idata    = deepcopy(data)
-    pupil    = idata.pupil.copy()
-    nanpupil = idata.pupil_nan.copy()
-    times    = idata.time.copy()
-    
-    mask = np.zeros_like(times, dtype=bool)
-    mask |= np.isnan(nanpupil)
-    
-    interpolated = np.interp(
-        times[mask],
-        times[~mask],
-        pupil[~mask]
-        )
-    
-    cleanpupil = nanpupil.copy()
-    cleanpupil[mask] = interpolated
-    setattr(idata, 'pupil_clean', cleanpupil)
+    idata = data
+    _interpolate_nans(idata.pupil, _blinkmask(idata, ''), idata.time, out = idata.channels.row('pupil_clean'))
     return idata
 
-def _interpolate_blinks_binocular(data):
+def _interpolate_blinks_binocular(data, eyes = None):
     '''
     data - a single block of recorded data (class: EyeHolder)
     '''
-    idata = deepcopy(data)
-    for eye in idata.eyes_recorded:
+    idata = data
+    for eye in (idata.eyes_recorded if eyes is None else eyes):
         ieye = eye[0] #get suffix label
-        pupil    = getattr(idata, f'pupil_{ieye}').copy()
-        nanpupil = getattr(idata, f'pupil_nan_{ieye}').copy()
-        times    = getattr(idata, 'time').copy()
-
-        mask = np.zeros_like(times, dtype=bool)
-        mask |= np.isnan(nanpupil)
-
-        interpolated = np.interp(
-            times[mask],
-            times[~mask],
-            pupil[~mask]
-        )
-        cleanpupil = nanpupil.copy()
-        cleanpupil[mask] = interpolated
-        setattr(idata, f'pupil_clean_{ieye}', cleanpupil)
+        _interpolate_nans(getattr(idata, f'pupil_{ieye}'), _blinkmask(idata, f'_{ieye}'), idata.time, out = idata.channels.row(f'pupil_clean_{ieye}'))
     return idata
 
+def _blinkmask(data, suffix):
+    '''
+    boolean mask of the samples of an eye to interpolate over, from identify_blinks (either the blinkmask, or the nan samples of pupil_nan)
+    '''
+    if 'blinkmask'+suffix in data.attrs:
+        return data.attrs['blinkmask'+suffix]
+    return np.isnan(getattr(data, 'pupil_nan'+suffix))
+
+def _interpolate_nans(pupil, mask, times, out = None):
+    '''
+    linearly interpolate over the masked samples of pupil, into out (a new array if None). returns out, pupil and mask are not modified.
+
+    each run of masked samples is interpolated between the samples either side of it (or takes the value of the one there is, at the
+    ends of the trace) as np.interp would, so the temporary arrays are the size of the masked samples rather than of the trace
+    '''
+    nsamps = mask.size
+    _, starts, ends = runs(mask.reshape(1, -1))
+    if starts.size > 0 and starts[0] == 0 and ends[0] == nsamps: #nothing to interpolate from
+        raise ValueError('all samples of the trace are masked, so there is nothing to interpolate from')
+    before = np.where(starts > 0, starts - 1, ends)    #sample before each run, or after it for a run at the start
+    after  = np.where(ends < nsamps, ends, starts - 1) #and after it, or before it for a run at the end
+    lengths = ends - starts
+    samples = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum()) #the masked samples, in order
+    gap = np.repeat(np.arange(starts.size), lengths) #and the run each one is in
+    t0, t1 = times[before].astype(float), times[after].astype(float)
+    v0, v1 = pupil[before].astype(float), pupil[after].astype(float)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        slope = np.where(before == after, 0, (v1 - v0) / (t1 - t0))
+    interpolated = v0[gap] + slope[gap] * (times[samples] - t0[gap])
+    if out is None:
+        cleanpupil = pupil.copy()
+    else:
+        cleanpupil = out
+        cleanpupil[:] = pupil
+    cleanpupil[samples] = interpolated
+    return cleanpupil
+
+blink_chunksize = 2**16 #samples that _calculate_blink_periods works out the velocity of at a time
+
 def _calculate_blink_periods(pupil, srate,  blinkspd, maxvelthresh, maxpupilsize, cleanms):
-    signal = pupil.copy()
-    vel    = np.diff(pupil) #derivative of pupil diameter
-    speed  = np.abs(vel)    #absolute velocity
-    smoothv   = smooth(vel, twin = 8, method = 'boxcar') #smooth with a 8ms boxcar to remove tremor in signal
-    smoothspd = smooth(speed, twin = 8, method = 'boxcar') #smooth to remove some tremor
-    #not sure if it quantitatively changes anything if you use a gaussian instead. the gauss filter makes it smoother though
-    
-    #pupil size only ever reaches zero if missing data. so we'll log this as missing data anyways
-    zerosamples = np.zeros_like(pupil, dtype=bool)
-    zerosamples[pupil==0] = True
-    
+    '''
+    pupil - pupil trace of one eye ([nsamples]), or of several eyes stacked together ([neyes x nsamples]) which are processed in one go
+
+    returns the Blinks structure (a list of them, one per eye, for stacked eyes) and the boolean mask of bad samples
+    '''
     #create an array logging bad samples in the trace
     badsamples = np.zeros_like(pupil, dtype=bool)
-    badsamples[1:] = np.logical_or(speed >= maxvelthresh, pupil[1:] > maxpupilsize)
+    nsamps = pupil.shape[-1]
+    for start in range(1, nsamps, blink_chunksize): #a chunk at a time, so the velocity is never held for the whole trace
+        stop  = min(start + blink_chunksize, nsamps)
+        speed = np.abs(np.diff(pupil[..., start-1:stop], axis = -1)) #absolute velocity of pupil diameter
+        badsamples[..., start:stop] = np.logical_or(speed >= maxvelthresh, pupil[..., start:stop] > maxpupilsize)
     
-    #a quick way of marking data for removal is to smooth badsamples with a boxcar of the same width as your buffer.
-    #it spreads the 1s in badsamples to the buffer period around (each value becomes 1/buffer width)
-    #can then just check if badsamples > 0 and it gets all samples in the contaminated window
-    badsamples = np.greater(smooth(badsamples.astype(float), twin = int(cleanms), method = 'boxcar'), 0).astype(bool)
-    badsamps = (badsamples | zerosamples) #get whether its marked as a bad sample, OR marked as a previously zero sample ('blinks' to be interpolated)
-    signal[badsamps==1] = np.nan #set these bad samples to nan
+    #mark all samples within the buffer period around a bad sample for removal too. this is a moving window over badsamples,
+    #done with a cumulative sum so the cost doesn't depend on the width of the buffer (see utils.dilate)
+    badsamples = dilate(badsamples, int(cleanms))
+    #pupil size only ever reaches zero if missing data. so we'll log this as missing data anyways
+    badsamps = np.logical_or(badsamples, pupil == 0) #get whether its marked as a bad sample, OR marked as a previously zero sample ('blinks' to be interpolated)
     
+    if pupil.ndim == 1:
+        return _blinks_from_mask(badsamps, srate), badsamps
+    blinks = [_blinks_from_mask(x, srate) for x in badsamps]
+    return blinks, badsamps #return structure containing blink information, and which samples are to be interpolated
+
+def _blinks_from_mask(badsamps, srate):
+    '''
+    create a Blinks structure from the runs of bad samples in a single trace
+    '''
     #we want to  create 'blink' structures, so we need info here
-    changebads = np.zeros_like(pupil, dtype=int)
-    changebads[1:] = np.diff(badsamps.astype(int)) #+1 = from not missing -> missing; -1 = missing -> not missing
+    changebads = np.zeros(badsamps.size, dtype=np.int8)
+    changebads[1:] = np.diff(badsamps.view(np.int8)) #+1 = from not missing -> missing; -1 = missing -> not missing
 
     #starts are always off by one sample - when changebads == 1, the data is now MISSING. we need the sample before for interpolation
-    starts = np.squeeze(np.where(changebads==1)) -1
-    ends = np.squeeze(np.where(changebads==-1))
-
-    if starts.size != ends.size:
-        print(f"There is a problem with your data and the start/end of blinks dont match.\n- There are {starts.size} blink starts and {ends.size} blink ends")
-        if starts.size == ends.size - 1:
-            print('The recording starts on a blink; fixing')
-            starts = np.insert(starts, 0, 0, 0)
-        if starts.size == ends.size + 1:
-            print('The recording ends on a blink; fixing')
-            ends = np.append(ends, len(pupil))
+    starts = np.flatnonzero(changebads==1) -1
+    ends = np.flatnonzero(changebads==-1)
+    
+    if badsamps.size > 0 and badsamps[0]:
+        logger.debug('The recording starts on a blink; fixing')
+        starts = np.insert(starts, 0, 0, 0)
+    if badsamps.size > 0 and badsamps[-1]:
+        logger.debug('The recording ends on a blink; fixing')
+        ends = np.append(ends, badsamps.size)
 
     durations = np.divide(np.subtract(ends, starts), srate) #get duration of each saccade in seconds
     
     blinkarray = np.array([starts, ends, durations]).T
-    blinks = Blinks(blinkarray)
-    
-    return blinks, signal #return structure containing blink information, and trace that indicates whether a sample was missing or not
+    return Blinks(blinkarray)
+
+def _gaze_velocity(padded, srate):
+    '''
+    velocity of gaze along the last axis, averaged over a moving window of 5 samples (engbert & kliegl, 2003):
+    (x[n+2] + x[n+1] - x[n-1] - x[n-2]) / 6 samples. padded is the gaze with 2 extra samples at either end (e.g. the first and last repeated)
+    '''
+    velocity = np.add(padded[..., 4:], padded[..., 3:-1])
+    velocity -= padded[..., 1:-3]
+    velocity -= padded[..., :-4]
+    return np.multiply(velocity, srate / 6, out = velocity)
+
+def _run_reduce(ufunc, values, rows, starts, ends):
+    '''
+    reduce values ([nrows x nsamples]) over each run (see utils.runs) with a ufunc (e.g. np.maximum, np.add), all in one call
+    '''
+    if starts.size == 0:
+        return np.zeros(0)
+    nsamps = values.shape[-1]
+    flat = values.reshape(-1)
+    bounds = np.column_stack([rows * nsamps + starts, rows * nsamps + ends]).ravel()
+    if bounds[-1] == flat.size: #reduceat can't take the end of the data, but the last run goes up to it anyway
+        bounds = bounds[:-1]
+    return ufunc.reduceat(flat, bounds)[::2]
+
+def _run_mask(rows, starts, ends, shape):
+    '''
+    boolean mask ([nrows x nsamples]) of the samples in a set of runs (see utils.runs). only the samples in the runs are touched
+    '''
+    mask = np.zeros(shape = shape, dtype = bool)
+    lengths = ends - starts
+    offsets = np.repeat(rows * shape[-1] + starts - (np.cumsum(lengths) - lengths), lengths)
+    mask.reshape(-1)[np.arange(lengths.sum()) + offsets] = True
+    return mask
+
+def _binocular_agreement(eye, starts, ends, missing):
+    '''
+    which saccades of two eyes (eye is 0 or 1 for each) overlap in time with a saccade of the other eye, or happen while the other
+    eye has missing data ([2 x nsamples] mask)
+    '''
+    keep = np.zeros(eye.size, dtype = bool)
+    nmissing = np.zeros(shape = (2, missing.shape[-1]+1), dtype = np.int64)
+    np.cumsum(missing, axis = -1, out = nmissing[:, 1:])
+    for ieye, other in [(0, 1), (1, 0)]:
+        this, that = eye == ieye, eye == other
+        #saccades of an eye are in order and don't overlap, so the first one of the other eye that ends after the start is the only one to check
+        first = np.searchsorted(ends[that], starts[this], side = 'right')
+        otherstarts = np.append(starts[that], np.iinfo(np.int64).max)
+        overlap = otherstarts[first] < ends[this]
+        othermissing = nmissing[other, ends[this]] > nmissing[other, starts[this]]
+        keep[this] = overlap | othermissing
+    return keep
 
 def _rename_attribute(obj, old_name, new_name):
-    obj.__dict__[new_name] = obj.__dict__.pop(old_name)
\ No newline at end of file
+    if isinstance(obj, EyeHolder):
+        obj.rename_channel(old_name, new_name)
+    else:
+        obj.__dict__[new_name] = obj.__dict__.pop(old_name)
\ No newline at end of file
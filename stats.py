@@ -0,0 +1,225 @@
+import numpy as np
+import scipy as sp
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from .utils import runs
+
+class RunningStats():
+    '''
+    running count, mean and variance of data that come in bit by bit (e.g. block by block, or file by file), ignoring nans.
+
+    update() adds an array of data, and merge() (or +) combines the statistics of separate runs (e.g. from other files or worker processes),
+    using Welford's/Chan's updates so nothing but the count, mean and sum of squared differences from the mean has to be kept.
+    the result is the same as computing the (nan-ignoring) mean and variance of all the data at once
+    '''
+    def __init__(self):
+        self.n    = 0
+        self.mean = 0.
+        self.m2   = 0.   #sum of squared differences from the mean
+
+    @classmethod
+    def from_array(cls, values):
+        return cls().update(values)
+
+    def update(self, values, chunksize = 2**16):
+        '''
+        add the (non-nan) values of an array of any shape. they are added chunksize values at a time, so the temporary arrays
+        stay small however long the data are
+        '''
+        values = np.asarray(values).ravel()
+        for start in range(0, values.size, chunksize):
+            chunk  = values[start:start+chunksize]
+            finite = chunk[~np.isnan(chunk)]
+            if finite.size > 0:
+                mean = finite.mean(dtype = np.float64)
+                m2   = np.square(finite - mean, dtype = np.float64).sum()
+                self._combine(finite.size, mean, m2)
+        return self
+
+    def merge(self, other):
+        '''
+        add the statistics of another RunningStats to these
+        '''
+        if other.n > 0:
+            self._combine(other.n, other.mean, other.m2)
+        return self
+
+    def _combine(self, n, mean, m2):
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2   = self.m2 + m2 + delta**2 * self.n * n / total
+        self.n    = total
+
+    def __add__(self, other):
+        return RunningStats().merge(self).merge(other)
+
+    def __radd__(self, other): #so sum() works on a list of RunningStats
+        if isinstance(other, (int, float)) and other == 0:
+            return RunningStats().merge(self)
+        return self.__add__(other)
+
+    @property
+    def var(self):
+        '''
+        (population) variance, as np.var and scipy.stats.zscore use
+        '''
+        return self.m2 / self.n if self.n > 0 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def __repr__(self):
+        return f'RunningStats(n = {self.n}, mean = {self.mean}, std = {self.std})'
+
+def normalize(values, stats, method = 'zscore', out = None):
+    '''
+    normalize an array using a set of statistics (RunningStats): 'zscore' ((values - mean) / std) or 'percent' change from the mean.
+    out can be values itself, to normalize in place
+    '''
+    if method not in ['zscore', 'percent']:
+        raise ValueError(f"method must be one of 'zscore' or 'percent', got {method}")
+    out = np.subtract(values, stats.mean, out = out)
+    if method == 'zscore':
+        np.divide(out, stats.std, out = out)
+    else:
+        np.multiply(out, 100 / stats.mean, out = out)
+    return out
+
+def permutation_clusters(data, groups = None, nperm = 1000, threshold = None, tail = 0, seed = 0, n_jobs = 1, chunksize = 100):
+    '''
+    cluster-based permutation test (maris & oostenveld, 2007) along the time axis of data ([nunits x ntimes], e.g. trials), ignoring nans.
+
+    groups    -- the group (0 or 1) of each unit, compared with an independent-samples t-test. if None, the units are tested against 0
+                 with a one-sample t-test, permuted by flipping their signs
+    nperm     -- number of permutations
+    threshold -- t value that samples have to pass to form a cluster. defaults to the one for p < .05 (two-sided if tail is 0)
+    tail      -- 0 (default) tests both positive and negative clusters, 1 only positive and -1 only negative ones
+    seed      -- seed for the permutations. each chunk of chunksize permutations gets its own stream (numpy.random.SeedSequence.spawn),
+                 so the result only depends on the seed and chunksize, not on n_jobs
+    n_jobs    -- number of processes to run chunks of permutations in
+
+    the t statistics of a chunk of permutations are found at once, as matrix products of the permuted designs with the data,
+    and the clusters of all of them with a single run-length pass (see utils.runs).
+    returns the t values ([ntimes]), a dataframe of the clusters (start and end samples, mass (the sum of the t values) and p value),
+    and the null distribution of the largest cluster mass in each permutation
+    '''
+    data = np.asarray(data, dtype = float)
+    if tail not in [-1, 0, 1]:
+        raise ValueError(f'tail must be one of -1, 0 or 1, got {tail}')
+    good = ~np.isnan(data)
+    data = np.where(good, data, 0)
+    if groups is None:
+        design = np.ones(shape = (1, data.shape[0]))
+        df = data.shape[0] - 1
+    else:
+        groups = np.asarray(groups).astype(bool)
+        if groups.all() or not groups.any():
+            raise ValueError('both groups need at least one unit')
+        design = groups[np.newaxis].astype(float)
+        df = data.shape[0] - 2
+    if threshold is None:
+        threshold = sp.stats.t.ppf(1 - 0.05 / (2 if tail == 0 else 1), df)
+
+    tvals = _tstats(data, good, design, onesample = groups is None)
+    rows, starts, ends, masses = _clusters(tvals, threshold, tail)
+
+    sizes  = [min(chunksize, nperm - start) for start in range(0, nperm, chunksize)]
+    seeds  = np.random.SeedSequence(seed).spawn(len(sizes))
+    args   = (data, good, design[0], groups is None, threshold, tail)
+    if n_jobs == 1:
+        null = [_null_chunk(*args, size, chunkseed) for size, chunkseed in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+            futures = [pool.submit(_null_chunk, *args, size, chunkseed) for size, chunkseed in zip(sizes, seeds)]
+            null = [future.result() for future in futures]
+    null = np.concatenate(null) if len(null) > 0 else np.zeros(0)
+
+    pvalues = (np.sum(null[np.newaxis] >= np.abs(masses)[:, np.newaxis], axis = 1) + 1) / (null.size + 1)
+    clusters = pd.DataFrame(dict(start = starts, end = ends, mass = masses, pvalue = pvalues))
+    return tvals[0], clusters.sort_values('start', ignore_index = True), null
+
+def _tstats(data, good, design, onesample):
+    '''
+    t statistics of a batch of designs at once. design is [ndesigns x nunits]: the signs of the units (one-sample test)
+    or which units are in the first group (independent-samples test, with pooled variance). data has its nans set to 0
+    '''
+    counts = good.sum(axis = 0)
+    sqsums = np.square(data).sum(axis = 0)
+    sums   = design @ data
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        if onesample: #flipping signs doesn't change the sum of squares
+            mean = sums / counts
+            var  = (sqsums - counts * mean**2) / (counts - 1)
+            return mean / np.sqrt(var / counts)
+        allgood = good.all()
+        n1 = design.sum(axis = 1, keepdims = True) if allgood else design @ good
+        n2 = counts - n1
+        s2 = data.sum(axis = 0) - sums
+        q1 = design @ np.square(data)
+        ss = (q1 - sums**2 / n1) + (sqsums - q1 - s2**2 / n2) #sums of squares within each group
+        var = ss / (n1 + n2 - 2) * (1 / n1 + 1 / n2)
+        return (sums / n1 - s2 / n2) / np.sqrt(var)
+
+def _clusters(tvals, threshold, tail):
+    '''
+    row, start, end (the sample after) and mass (sum of the t values) of every cluster in a [nrows x ntimes] array of t values
+    '''
+    cumulative = np.zeros(shape = (tvals.shape[0], tvals.shape[1]+1))
+    np.cumsum(np.nan_to_num(tvals), axis = 1, out = cumulative[:, 1:])
+    found = []
+    for sign in ([1, -1] if tail == 0 else [tail]):
+        with np.errstate(invalid = 'ignore'):
+            rows, starts, ends = runs(sign * tvals > threshold)
+        found.append((rows, starts, ends, cumulative[rows, ends] - cumulative[rows, starts]))
+    return [np.concatenate(x) for x in zip(*found)]
+
+def _null_chunk(data, good, design, onesample, threshold, tail, nperm, seed):
+    '''
+    largest cluster mass (in absolute value) of each of a chunk of permutations of a design (see _tstats)
+    '''
+    rng = np.random.default_rng(seed)
+    if onesample:
+        design = rng.choice([-1., 1.], size = (nperm, design.size))
+    else:
+        design = rng.permuted(np.tile(design, (nperm, 1)), axis = 1)
+    rows, starts, ends, masses = _clusters(_tstats(data, good, design, onesample), threshold, tail)
+    largest = np.zeros(nperm)
+    np.maximum.at(largest, rows, np.abs(masses))
+    return largest
+
+def cluster_test(epochs, channel, conditions = None, by = 'event_id', tmin = None, tmax = None, **kwargs):
+    '''
+    cluster-based permutation test across the trials of epoched data (class: epochedEyes), on one channel between tmin and tmax.
+
+    conditions -- the two conditions (values of by) to compare, or a single condition (or None for all trials) to test against 0,
+                  e.g. after baselining
+    by         -- 'event_id' (default) or a metadata column to get the condition of each trial from
+    the other arguments (nperm, threshold, tail, seed, n_jobs, chunksize) are passed to permutation_clusters.
+
+    returns the times, the t values, a dataframe of the clusters with their start and end times (tmin, tmax), mass and p value,
+    and the null distribution of the largest cluster mass
+    '''
+    if by == 'event_id':
+        labels = np.asarray(epochs.event_id)
+    elif isinstance(epochs.metadata, pd.DataFrame):
+        labels = epochs.metadata[by].to_numpy()
+    else:
+        raise ValueError('no metadata to get the conditions from')
+    if conditions is None:
+        trials = np.arange(epochs.ntrials)
+    else:
+        conditions = np.atleast_1d(conditions)
+        if conditions.size not in [1, 2]:
+            raise ValueError(f'can compare one or two conditions, got {conditions.size}')
+        trials = np.flatnonzero(np.isin(labels, conditions))
+    window = epochs._timeslice(tmin, tmax)
+    data   = epochs.get_data(trials, copy = False)[:, list(epochs.channels).index(channel), window]
+    groups = labels[trials] == conditions[0] if conditions is not None and conditions.size == 2 else None
+
+    tvals, clusters, null = permutation_clusters(data, groups, **kwargs)
+    times = epochs.times[window]
+    clusters.insert(0, 'tmin', times[clusters['start']])
+    clusters.insert(1, 'tmax', times[clusters['end'] - 1])
+    return times, tvals, clusters, null
@@ -1,49 +1,148 @@
 import numpy as np
 import scipy as sp
-from .epochs import epochedEyes
+from .epochs import epochedEyes, LazyEpochSource
+from . import filters
 
-def smooth(signal, twin = 50, method = 'boxcar'):
+def smooth(signal, twin = 50, method = 'boxcar', srate = 1000, axis = -1):
     '''
 
     function to smooth a signal. defaults to a 50ms boxcar smoothing (so quite small), just smooths out some of the tremor in the trace signals to clean it a bit
+    can take multiple signals at once (e.g. all the channels of a block), smoothed along axis. nan samples are left out of the smoothing and stay nan
     can change the following parameters:
 
-    twin    -- number of samples (if 1KHz sampling rate, then ms) for the window
-    method  -- type of smoothing (defaults to a boxcar smoothing) - defaults to a boxcar
+    twin    -- number of samples (if 1KHz sampling rate, then ms) for the window. for a gaussian this is its standard deviation,
+               and for a butterworth filter the period of the cutoff frequency (cutoff = srate/twin Hz)
+    method  -- type of smoothing: 'boxcar' (defaults to a boxcar smoothing), 'gaussian' or 'butterworth' (zero-phase low-pass). see filters
+    srate   -- sampling rate of the signal, only used by the butterworth filter
     '''
     if method == 'boxcar':
-        #set up the boxcar
-        filt = sp.signal.windows.boxcar(twin)
-
-    #smooth the signal
-    if method == 'boxcar':
-        smoothed_signal = np.convolve(filt/filt.sum(), signal, mode = 'same')
+        smoothed_signal = filters.boxcar(signal, twin, axis = axis)
+    elif method == 'gaussian':
+        smoothed_signal = filters.gaussian(signal, twin, axis = axis)
+    elif method == 'butterworth':
+        smoothed_signal = filters.butterworth(signal, srate/twin, srate, axis = axis)
+    else:
+        raise ValueError(f"method must be one of 'boxcar', 'gaussian' or 'butterworth', got {method}")
 
     return smoothed_signal
 
+def dilate(mask, width):
+    '''
+    spread True values in a boolean mask to the samples around them, along the last axis (so can take multiple traces at once).
+
+    a sample is marked if there is a True value within a window of `width` samples centred on it, which gives the same result as
+    smooth(mask, twin = width, method = 'boxcar') > 0. like the boxcar, it uses a cumulative sum so the cost doesn't depend on the window width
+    '''
+    mask = np.asarray(mask, dtype = bool)
+    if width <= 1:
+        return mask.copy()
+    return filters._window_sums(mask, width) > 0
+
+def runs(mask):
+    '''
+    the row, start and end (the sample after) of each run of True values in a [nrows x nsamples] mask (e.g. of several eyes or permutations).
+    all rows are done at once, separated by a False sample either side so runs can't join up across rows
+    '''
+    nrows, nsamps = mask.shape
+    padded = np.zeros(shape = (nrows, nsamps+2), dtype = np.int8)
+    padded[:, 1:-1] = mask
+    change = np.diff(padded.ravel())
+    starts = np.flatnonzero(change == 1) #flat index of the sample before each run in padded, so the sample index in the row
+    ends   = np.flatnonzero(change == -1)
+    rows   = starts // (nsamps+2)
+    return rows, starts - rows * (nsamps+2), ends - rows * (nsamps+2)
+
+def resample(signals, up, down):
+    '''
+    resample signals (along the last axis, so can take multiple traces at once) by a factor of up/down, using polyphase filtering
+    (scipy.signal.resample_poly) so there is no aliasing.
+
+    the filtered signals are divided by the filtered mask of good samples, so nan samples are left out of the filtering (output samples
+    nearest to a nan sample are nan too), and the ends of the signals aren't pulled towards zero by the filter's zero padding
+    '''
+    signals = np.asarray(signals)
+    good = ~np.isnan(signals)
+    if good.all(): #the mask is the same for every signal, so only filter it once
+        resampled = sp.signal.resample_poly(signals, up, down, axis = -1)
+        weights   = sp.signal.resample_poly(np.ones(signals.shape[-1]), up, down)
+    else:
+        resampled = sp.signal.resample_poly(np.where(good, signals, 0), up, down, axis = -1)
+        weights   = sp.signal.resample_poly(good.astype(float), up, down, axis = -1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        np.divide(resampled, weights, out = resampled)
+    nearest = np.minimum(np.round(np.arange(resampled.shape[-1]) * down / up).astype(int), signals.shape[-1]-1)
+    resampled[~good[..., nearest]] = np.nan
+    return resampled
+
+def polydetrend(times, signals, order = 3, out = None, chunksize = 2**14):
+    '''
+    fit a polynomial of the given order to one or more signals by (linear) least squares, in closed form.
+
+    times     -- [nsamples] sample times shared by the signals
+    signals   -- [nsamples] or [nsignals x nsamples] array. all signals are fit in one go. nan samples are left out of the fit
+    order     -- order of the polynomial (3 = cubic)
+    out       -- optional (modelled, detrended) pair of arrays the shape of signals to write the results into (e.g. rows of a ChannelStore)
+    chunksize -- number of samples to work through at a time
+
+    the fit uses a legendre basis over the times scaled to [-1, 1] so it stays well conditioned for long recordings.
+    the normal equations of each signal are added up chunksize samples at a time, so the design matrix ([nsamples x order+1])
+    is never held in full and the temporary arrays stay small however long the signals are.
+    returns the modelled polynomial and the detrended signals (signals - modelled), both the same shape as signals
+    '''
+    signals = np.asarray(signals)
+    flat    = np.atleast_2d(signals)
+    times   = np.asarray(times) #converted to float a chunk at a time
+    nsamps  = flat.shape[1]
+    chunks  = [slice(start, min(start+chunksize, nsamps)) for start in range(0, nsamps, chunksize)]
+    start, span = (float(times[0]), float(times[-1]) - float(times[0])) if nsamps > 0 else (0., 0.)
+    
+    grams = np.zeros(shape = (flat.shape[0], order+1, order+1)) #[nsignals x order+1 x order+1], over the finite samples of each signal
+    rhs   = np.zeros(shape = (flat.shape[0], order+1))
+    for chunk in chunks:
+        basis  = _polybasis(times[chunk], start, span, order)
+        values = flat[:, chunk].astype(float)
+        finite = np.isfinite(values)
+        grams += np.einsum('sn,ni,nj->sij', finite, basis, basis, optimize = True)
+        rhs   += np.where(finite, values, 0) @ basis
+    coefs = np.full(shape = rhs.shape, fill_value = np.nan)
+    fitted = np.linalg.matrix_rank(grams) == order+1 if nsamps > 0 else np.zeros(flat.shape[0], dtype = bool) #not enough data to fit otherwise
+    if fitted.any():
+        coefs[fitted] = np.linalg.solve(grams[fitted], rhs[fitted][..., None])[..., 0]
+    
+    if out is None:
+        out = (np.empty(shape = signals.shape), np.empty(shape = signals.shape))
+    modelled, detrended = [x.reshape(flat.shape) for x in out]
+    for chunk in chunks:
+        modelled[:, chunk]  = coefs @ _polybasis(times[chunk], start, span, order).T
+        detrended[:, chunk] = flat[:, chunk] - modelled[:, chunk]
+    return out
+
+def _polybasis(times, start, span, order):
+    '''
+    legendre design matrix ([nsamples x order+1]) for times, scaled so that start to start + span is [-1, 1]
+    '''
+    times  = np.asarray(times, dtype = float)
+    scaled = (2*(times - start) / span) - 1 if span > 0 else np.zeros_like(times)
+    return np.polynomial.legendre.legvander(scaled, order)
+
 def strip_plr(data, plrtrigger, pre_buffer = 3):
     for iblock in range(data.nblocks):
-        if plrtrigger in data.data[iblock].triggers.event_id:
+        if plrtrigger in data.data[iblock].triggers.label_codes:
             tmpdata = data.data[iblock]
-            plrtrigs = np.where(tmpdata.triggers.event_id == plrtrigger)[0] #get indices of plr triggers
+            plrtrigs = tmpdata.triggers.find(plrtrigger) #get indices of plr triggers
             ftrig = plrtrigs[-1]+1 #get the next trigger after the last PLR (start of the first trial of task)
             ftrig_time = tmpdata.triggers.timestamp[ftrig]
             ftrigtime_cropped = ftrig_time - (data.srate*pre_buffer)
             
             #find all timepoints that occur before this cropped timepoint
-            delinds = np.squeeze(np.where(tmpdata.trackertime < ftrigtime_cropped))
+            keepinds = tmpdata.trackertime >= ftrigtime_cropped
             
-            #remove data from relevant signals
-            tmpdata.xpos = np.delete(tmpdata.xpos, delinds)
-            tmpdata.ypos = np.delete(tmpdata.ypos, delinds)
-            tmpdata.pupil = np.delete(tmpdata.pupil, delinds)
-            tmpdata.trackertime = np.delete(tmpdata.trackertime, delinds)
+            #remove data from all channels at once
+            tmpdata.select_samples(keepinds)
             tmpdata.fsamp = tmpdata.trackertime[0] #reset the first sample
             tmpdata.time = np.subtract(tmpdata.trackertime, tmpdata.fsamp) #update the time array
             
-            trigs2rem = np.where(tmpdata.triggers.timestamp < ftrigtime_cropped)
-            tmpdata.triggers.timestamp = np.delete(tmpdata.triggers.timestamp, trigs2rem)
-            tmpdata.triggers.event_id  = np.delete(tmpdata.triggers.event_id, trigs2rem)
+            tmpdata.triggers = tmpdata.triggers.select(tmpdata.triggers.in_range(ftrigtime_cropped, np.inf)) #triggers are sorted, so keep the ones from here on
             
             #set the data
             data.data[iblock] = tmpdata
@@ -56,36 +155,55 @@ def strip_plr(data, plrtrigger, pre_buffer = 3):
     
     return data #return the stripped data object
 
-def epochs(data, tmin, tmax, triggers, channels):
+def epochs(data, tmin, tmax, triggers, channels, on_edge = 'nan', lazy = False):
+    '''
+    epoch continuous data around triggers
+
+    data     -- rawEyes object
+    tmin     -- start of the epoch relative to the trigger (in seconds)
+    tmax     -- end of the epoch relative to the trigger (in seconds)
+    triggers -- list of triggers (event_id) to epoch around
+    channels -- list of channels to epoch
+    on_edge  -- what to do with epochs that run past the start or end of a block. 'nan' (default) pads the missing samples with nan, 'drop' removes these epochs
+    lazy     -- if True, the epochs are not copied out of the continuous data. they are held as views of the data (see epochs.LazyEpochSource)
+                until they are modified (e.g. apply_baseline) or the data is requested (epoched.data, epoched.load_data())
+    
+    triggers are matched to the first sample recorded at or after the trigger timestamp, so triggers that fall between samples are kept
+    '''
+    if on_edge not in ['nan', 'drop']:
+        raise ValueError(f'on_edge must be one of "nan" or "drop", got {on_edge}')
     chanlist = channels
     nblocks = data.nblocks
     srate = data.srate
-    nchans = len(channels)
-    blocks = data.blocks
-    allepochs = []
-    alltrigs  = []
+    blocks = getattr(data, 'blocks', None)
+    ntimes     = np.arange(tmin, tmax, 1/srate).size
+    offset     = int(np.round(tmin*srate)) #sample offset of the start of the epoch, relative to the trigger
+    epochtimes = np.arange(offset, offset + ntimes) / srate #time of each sample of the epoch, relative to the trigger
+    blockdata   = []
+    trialblocks = []
+    allstarts   = []
+    alltrigs    = []
     for iblock in range(nblocks):
         tmpdata = data.data[iblock]
-        findtrigs = np.isin(tmpdata.triggers.event_id, triggers) #check if triggers are present
+        findtrigs = tmpdata.triggers.find(triggers) #indices of the triggers that are present, in order
         epoched_events = tmpdata.triggers.event_id[findtrigs] #store the triggers that are found, in order
-        trigttimes = tmpdata.triggers.timestamp[findtrigs]     #get trackertime for the trigger onset
-        trigtimes = np.squeeze(np.where(np.isin(tmpdata.trackertime, trigttimes))) #get indices of the trigger onsets
-        tmins = np.add(trigtimes, tmin*srate).astype(int) #enforce integer so you can use it as an index
-        tmaxs = np.add(trigtimes, tmax*srate).astype(int) #enforce integer so you can use it as an index
-        iepochs = np.zeros(shape = [trigtimes.size, nchans, np.arange(tmin, tmax, 1/srate).size])
-        for itrig in range(tmins.size):
-            for ichan in range(nchans):
-                iepochs[itrig, ichan] = getattr(tmpdata, channels[ichan])[tmins[itrig]:tmaxs[itrig]]
-        allepochs.append(iepochs)
+        starts = tmpdata.triggers.get_samples(tmpdata.trackertime)[findtrigs] + offset #get indices of the trigger onsets, and shift to the start of the epoch
+        if on_edge == 'drop':
+            keep = np.logical_and(starts >= 0, starts + ntimes <= tmpdata.trackertime.size)
+            starts, epoched_events = starts[keep], epoched_events[keep]
+        
+        if lazy and tmpdata.channels is not None: #the epochs keep views of the channels, so they mustn't be changed in place from here on
+            blockdata.append([tmpdata.channels.share(x) if x in tmpdata.channels else getattr(tmpdata, x) for x in channels])
+        else:
+            blockdata.append([getattr(tmpdata, x) for x in channels])
+        trialblocks.append(np.full(starts.size, iblock))
+        allstarts.append(starts)
         alltrigs.append(epoched_events)
-    stacked  = np.vstack(allepochs)
+    source = LazyEpochSource(blockdata, np.hstack(trialblocks).astype(int), np.hstack(allstarts).astype(int), ntimes)
     alltrigs = np.hstack(alltrigs)
-    epochtimes = np.arange(tmin, tmax, 1/srate)
-    #round this to match the sampling rate
-    epochtimes = np.round(epochtimes, 3) #round to the nearest milisecond as we dont record faster than 1khz
     
     #create new object
-    epoched = epochedEyes(data = stacked, srate = srate, events = alltrigs, times = epochtimes, channels = chanlist)
+    epoched = epochedEyes(data = source if lazy else source.gather(), srate = srate, events = alltrigs, times = epochtimes, channels = chanlist)
     setattr(epoched, 'blocks', blocks) #log the blocks of data that went into this epoched structure
     # setattr(epoched, channels, chanlist)
 